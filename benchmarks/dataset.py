@@ -0,0 +1,237 @@
+"""Fill the database with a synthetic week of posts and interactions to load test the feeds.
+
+Every table is emptied first, so point it at a disposable database::
+
+    BSKY_HOSTNAME=localhost python -m benchmarks.dataset --users 500000 --posts 3000000 --likes 30000000 --yes
+
+Rows are generated by Postgres itself. Authors, liked posts and followers follow power laws, so a
+few accounts get most of the activity and followers, and languages are drawn with the weights below.
+"""
+import argparse
+import time
+
+from server import config, feed_index, follows, partitions, timelines
+from server.database import db, Interaction, Language, Post, PostLanguage, PostStats, TimelineEntry, User
+
+REQUESTER_DID = 'did:plc:benchmark'
+
+LANGUAGE_WEIGHTS = {
+    'en': 0.45,
+    'ja': 0.2,
+    'es': 0.1,
+    'pt': 0.1,
+    'de': 0.05,
+    'ca': 0.04,
+    'gl': 0.03,
+    'eu': 0.03,
+}
+
+# Share of posts that are replies, and of interactions that are reposts
+REPLY_RATIO = 0.3
+REPOST_RATIO = 0.1
+
+# Rows generated per statement, keeping each transaction small enough
+CHUNK_SIZE = 1000000
+
+_NOW = "(now() AT TIME ZONE 'utc')"
+
+
+def step(message):
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            print(f'{message}...', end=' ', flush=True)
+            result = function(*args, **kwargs)
+            print(f'{time.perf_counter() - start:.1f}s')
+            return result
+        return wrapper
+    return decorator
+
+
+def chunks(total):
+    for first in range(1, total + 1, CHUNK_SIZE):
+        yield first, min(first + CHUNK_SIZE - 1, total)
+
+
+@step('Emptying tables')
+def truncate():
+    tables = [User, Language, Post, PostLanguage, Interaction, PostStats, TimelineEntry]
+    db.execute_sql(f'TRUNCATE {", ".join(model._meta.table_name for model in tables)} RESTART IDENTITY CASCADE')
+
+    for language_code in config.LANGUAGE_FEEDS:
+        feed_index.redis.delete(feed_index._KEY.format(language_code), feed_index._READY_KEY.format(language_code))
+
+
+@step('Creating users')
+def create_users(users):
+    db.execute_sql(
+        f"""
+        INSERT INTO "user" (did, handle, followers_count, follows_count, posts_count, indexed_at, last_update)
+        SELECT
+            'did:plc:bench' || g,
+            'bench' || g || '.bsky.social',
+            least(floor(10 / power(1 - random(), 1.2)), 1000000),
+            floor(random() * 1000),
+            floor(power(random(), 4) * 10000),
+            {_NOW}, {_NOW}
+        FROM generate_series(1, %s) g
+        """,
+        (users,),
+    )
+
+
+@step('Creating languages')
+def create_languages():
+    Language.insert_many([{'code': code} for code in LANGUAGE_WEIGHTS]).execute()
+    return dict(Language.select(Language.code, Language.id).tuples())
+
+
+@step('Creating posts')
+def create_posts(users, posts, days):
+    for first, last in chunks(posts):
+        with db.atomic():
+            db.execute_sql(
+                f"""
+                INSERT INTO post (author_id, uri, cid, indexed_at, created_at)
+                SELECT author_id, 'at://did:plc:bench' || author_id || '/app.bsky.feed.post/' || g, 'bafybench' || g, created_at, created_at
+                FROM (
+                    SELECT g, floor(power(random(), 3) * %s)::int + 1 AS author_id, {_NOW} - random() * interval '1 day' * %s AS created_at
+                    FROM generate_series(%s, %s) g
+                ) s
+                """,
+                (users, days, first, last),
+            )
+
+    # Replies point to an earlier post in the same thread, spread over the posts before them
+    db.execute_sql(
+        """
+        UPDATE post SET reply_root = parent.uri, reply_parent = parent.uri
+        FROM post parent
+        WHERE random() < %s AND parent.id = greatest(post.id - 1 - (post.id * 7919) %% 1000, 1) AND parent.id <> post.id
+        """,
+        (REPLY_RATIO,),
+    )
+
+
+@step('Assigning languages')
+def assign_languages(language_ids):
+    cases, threshold = [], 0
+    for code, weight in LANGUAGE_WEIGHTS.items():
+        threshold += weight
+        cases.append(f'WHEN r < {threshold} THEN {language_ids[code]}')
+
+    db.execute_sql(
+        f"""
+        INSERT INTO post_language_through (post_id, language_id)
+        SELECT id, CASE {" ".join(cases)} ELSE {language_ids['en']} END
+        FROM (SELECT id, random() AS r FROM post) s
+        """
+    )
+
+
+@step('Creating interactions')
+def create_interactions(users, posts, interactions, days):
+    partitions.create(config.PARTITION_DAYS_AHEAD, days)
+
+    for first, last in chunks(interactions):
+        with db.atomic():
+            db.execute_sql(
+                f"""
+                INSERT INTO interaction (uri, cid, author_id, post_id, interaction_type, indexed_at, created_at)
+                SELECT
+                    'at://did:plc:bench' || s.author_id || '/app.bsky.feed.' || (CASE WHEN s.repost THEN 'repost' ELSE 'like' END) || '/' || s.g,
+                    'bafybench' || s.g,
+                    s.author_id,
+                    post.id,
+                    CASE WHEN s.repost THEN %s ELSE %s END,
+                    t.created_at,
+                    t.created_at
+                FROM (
+                    SELECT g, floor(power(random(), 2) * %s)::int + 1 AS author_id, floor(power(random(), 4) * %s)::int + 1 AS post_id, random() < %s AS repost
+                    FROM generate_series(%s, %s) g
+                ) s
+                JOIN post ON post.id = s.post_id
+                CROSS JOIN LATERAL (SELECT post.created_at + random() * ({_NOW} - post.created_at) AS created_at) t
+                """,
+                (Interaction.REPOST, Interaction.LIKE, users, posts, REPOST_RATIO, first, last),
+            )
+
+
+@step('Computing post stats')
+def create_post_stats():
+    db.execute_sql(
+        """
+        INSERT INTO poststats (post_id, like_count, repost_count, last_like_at, like_milestone_at, last_repost_uri, last_repost_at)
+        SELECT
+            post_id,
+            count(*) FILTER (WHERE interaction_type = %s),
+            count(*) FILTER (WHERE interaction_type = %s),
+            max(created_at) FILTER (WHERE interaction_type = %s),
+            (array_agg(created_at ORDER BY created_at) FILTER (WHERE interaction_type = %s))[%s],
+            max(uri) FILTER (WHERE interaction_type = %s),
+            max(created_at) FILTER (WHERE interaction_type = %s)
+        FROM interaction
+        GROUP BY post_id
+        """,
+        (
+            Interaction.LIKE,
+            Interaction.REPOST,
+            Interaction.LIKE,
+            Interaction.LIKE,
+            config.LIKES_MILESTONE,
+            Interaction.REPOST,
+            Interaction.REPOST,
+        ),
+    )
+
+
+@step('Analyzing')
+def analyze():
+    db.execute_sql('ANALYZE')
+
+
+@step('Building timelines')
+def build_timelines(language_ids):
+    timelines.rebuild_top_spanish(language_ids[timelines.TOP_SPANISH_LANGUAGE])
+
+
+@step('Creating the requester')
+def create_requester(follows_count):
+    User.insert(did=REQUESTER_DID).execute()
+
+    # Followed accounts are the most active likers, so Discover pages are never empty
+    follows_dids = [
+        did
+        for did, in User.select(User.did).where(User.did != REQUESTER_DID).order_by(User.id).limit(follows_count).tuples()
+    ]
+    follows._store(REQUESTER_DID, follows_dids)
+    follows.redis.set(follows._FRESH_KEY.format(REQUESTER_DID), 1, ex=config.FOLLOWS_CACHE_TTL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500000)
+    parser.add_argument('--posts', type=int, default=3000000)
+    parser.add_argument('--likes', type=int, default=30000000, help='interactions, a share of them reposts')
+    parser.add_argument('--days', type=int, default=config.RETENTION_DAYS)
+    parser.add_argument('--follows', type=int, default=1000, help=f'accounts followed by {REQUESTER_DID}')
+    parser.add_argument('--yes', action='store_true', help='confirm the database can be emptied')
+    args = parser.parse_args()
+
+    if not args.yes:
+        parser.error('every table is emptied first, pass --yes to confirm')
+
+    truncate()
+    create_users(args.users)
+    language_ids = create_languages()
+    create_posts(args.users, args.posts, args.days)
+    assign_languages(language_ids)
+    create_interactions(args.users, args.posts, args.likes, args.days)
+    create_post_stats()
+    analyze()
+    build_timelines(language_ids)
+    create_requester(args.follows)
+
+
+if __name__ == '__main__':
+    main()
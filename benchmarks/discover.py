@@ -0,0 +1,122 @@
+"""Compare the Discover feed query passing follows as DIDs against passing them as a user id array.
+
+Runs against the configured database, so it should be populated with real data first::
+
+    BSKY_HOSTNAME=localhost python -m benchmarks.discover --sizes 100 1000 10000 --runs 5
+
+Follows are made up of the users who liked the most posts, a heavy but realistic requester.
+"""
+import argparse
+import statistics
+import time
+from datetime import datetime
+
+import peewee
+from peewee import fn
+
+from server.algos.discover import DiscoverAlgorithm
+from server.database import Post, User, Interaction, PostStats
+from server.utils import nth_item
+
+REQUESTER_DID = 'did:plc:benchmark'
+
+
+def legacy_posts_from_likes(algorithm, limit, user_follows_dids, requester_did):
+    # The query as it was written before follows were resolved to user ids
+    InteractionUser = User.alias()
+    PostUser = User.alias()
+
+    return Post.select(
+        Post.id,
+        Post.uri,
+        Post.cid,
+        nth_item(Interaction.created_at, algorithm.min_likes).alias("created_at"),
+        nth_item(InteractionUser.did, algorithm.min_likes).alias("like_by_did"),
+    ).join(
+        Interaction, on=(Interaction.post == Post.id)
+    ).join(
+        InteractionUser, on=(InteractionUser.id == Interaction.author)
+    ).join(
+        PostUser, on=(PostUser.id == Post.author)
+    ).join(
+        PostStats, on=(PostStats.post == Post.id)
+    ).where(
+        PostStats.like_count >= algorithm.min_likes,
+        Post.created_at <= datetime.utcnow(),
+        Interaction.interaction_type == Interaction.LIKE,
+        Interaction.created_at <= datetime.utcnow(),
+        InteractionUser.did.in_(user_follows_dids),
+        PostUser.did != requester_did,
+        (
+                PostUser.did.not_in(user_follows_dids)
+                | Post.reply_parent.is_null(False)
+        )
+    ).group_by(
+        Post.id,
+        Post.uri,
+        Post.cid,
+    ).having(
+        fn.COUNT(Interaction.author.distinct()) >= algorithm.min_likes,
+    ).order_by(
+        peewee.SQL("created_at DESC"),
+        Post.cid.desc(),
+    ).limit(limit)
+
+
+def get_follows_dids(size):
+    return [
+        did
+        for did, in User.select(
+            User.did
+        ).join(
+            Interaction, on=(Interaction.author == User.id)
+        ).where(
+            Interaction.interaction_type == Interaction.LIKE
+        ).group_by(
+            User.did
+        ).order_by(
+            fn.COUNT(Interaction.id).desc()
+        ).limit(size).tuples()
+    ]
+
+
+def measure(run, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--limit', type=int, default=30)
+    args = parser.parse_args()
+
+    algorithm = DiscoverAlgorithm()
+
+    print(f"{'follows':>8} {'legacy median':>14} {'legacy min':>11} {'ids median':>11} {'ids min':>8}")
+    for size in args.sizes:
+        follows_dids = get_follows_dids(size)
+
+        def legacy():
+            return list(legacy_posts_from_likes(algorithm, args.limit, follows_dids, REQUESTER_DID).dicts())
+
+        def ids():
+            # Resolving the DIDs is part of every request now, so it's measured as well
+            follows_ids = algorithm._get_user_ids(follows_dids)
+            return list(algorithm._get_posts_from_likes(args.limit, None, None, follows_ids, 0).dicts())
+
+        legacy_median, legacy_min = measure(legacy, args.runs)
+        ids_median, ids_min = measure(ids, args.runs)
+        print(
+            f"{len(follows_dids):>8} {legacy_median:>12.1f}ms {legacy_min:>9.1f}ms"
+            f" {ids_median:>9.1f}ms {ids_min:>6.1f}ms"
+        )
+
+
+if __name__ == '__main__':
+    main()
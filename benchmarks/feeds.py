@@ -0,0 +1,139 @@
+"""Load test every feed with deep cursor pagination and print the query plans of its handler.
+
+Meant for a database filled by :obj:`benchmarks.dataset`. By default handlers are called in
+process, which measures the queries without the page cache. Pass ``--url`` and an ``--token`` of
+the requester to go through ``getFeedSkeleton`` of a running server instead::
+
+    BSKY_HOSTNAME=localhost python -m benchmarks.feeds --pages 50 --runs 3
+    BSKY_HOSTNAME=localhost python -m benchmarks.feeds --url http://localhost:3333 --token eyJ...
+
+Plans are taken with ``EXPLAIN (ANALYZE, BUFFERS)`` for every query of the first page and of the
+deepest one reached.
+"""
+import argparse
+import statistics
+import time
+
+import requests
+
+from benchmarks.dataset import REQUESTER_DID
+from server.algos import algos
+from server.database import db
+
+
+def percentiles(timings):
+    if len(timings) < 2:
+        return [timings[0]] * 3 if timings else [0.0] * 3
+    cuts = statistics.quantiles(timings, n=100)
+    return [cuts[49], cuts[94], cuts[98]]
+
+
+class HandlerClient:
+    def get(self, feed, cursor, limit):
+        return algos[feed](cursor, limit, REQUESTER_DID)
+
+
+class HttpClient:
+    def __init__(self, url, token):
+        self.url = url.rstrip('/') + '/xrpc/app.bsky.feed.getFeedSkeleton'
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Bearer {token}'
+
+    def get(self, feed, cursor, limit):
+        params = {'feed': feed, 'limit': limit}
+        if cursor:
+            params['cursor'] = cursor
+
+        response = self.session.get(self.url, params=params)
+        response.raise_for_status()
+        return response.json()
+
+
+def paginate(client, feed, pages, limit):
+    """Walk the pages of a feed.
+
+    Returns:
+        :obj:`tuple`: Latency of every page in milliseconds and the cursor of the last page requested.
+    """
+    timings = []
+    cursor = last_cursor = None
+    for _ in range(pages):
+        start = time.perf_counter()
+        body = client.get(feed, cursor, limit)
+        timings.append((time.perf_counter() - start) * 1000)
+
+        last_cursor = cursor
+        cursor = body.get('cursor')
+        if not body['feed'] or not cursor or cursor == 'eof':
+            break
+
+    return timings, last_cursor
+
+
+def explain(feed, cursor, limit):
+    """Run a handler in process and return the plans of the queries it issued."""
+    queries = []
+    execute_sql = db.execute_sql
+
+    def recording_execute_sql(sql, params=None, *args, **kwargs):
+        if sql.lstrip().upper().startswith('SELECT'):
+            queries.append((sql, params))
+        return execute_sql(sql, params, *args, **kwargs)
+
+    db.execute_sql = recording_execute_sql
+    try:
+        algos[feed](cursor, limit, REQUESTER_DID)
+    finally:
+        db.execute_sql = execute_sql
+
+    plans = []
+    for sql, params in queries:
+        rows = db.execute_sql(f'EXPLAIN (ANALYZE, BUFFERS) {sql}', params).fetchall()
+        plans.append('\n'.join(row[0] for row in rows))
+    return plans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=50, help='pages walked per run, following the cursor')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--limit', type=int, default=30)
+    parser.add_argument('--url', help='base URL of a running server')
+    parser.add_argument('--token', help=f'bearer token of {REQUESTER_DID}, required with --url')
+    parser.add_argument('--no-explain', dest='explain', action='store_false')
+    args = parser.parse_args()
+
+    if args.url and not args.token:
+        parser.error('--token is required with --url')
+    client = HttpClient(args.url, args.token) if args.url else HandlerClient()
+
+    deepest_cursors = {}
+    print(f"{'feed':<60} {'pages':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'deepest':>9}")
+    for feed in algos:
+        timings, deepest = [], []
+        for _ in range(args.runs):
+            run_timings, deepest_cursors[feed] = paginate(client, feed, args.pages, args.limit)
+            timings.extend(run_timings)
+            deepest.append(run_timings[-1])
+
+        p50, p95, p99 = percentiles(timings)
+        print(
+            f'{feed:<60} {len(timings) // args.runs:>6} {p50:>7.1f}ms {p95:>7.1f}ms {p99:>7.1f}ms'
+            f' {statistics.median(deepest):>7.1f}ms'
+        )
+
+    if not args.explain:
+        return
+
+    for feed in algos:
+        for page, cursor in (('first page', None), ('deepest page', deepest_cursors[feed])):
+            print(f'\n=== {feed}, {page}')
+            plans = explain(feed, cursor, args.limit)
+            if not plans:
+                print('No queries, served from Redis')
+            for plan in plans:
+                print(plan, end='\n\n')
+
+
+if __name__ == '__main__':
+    main()
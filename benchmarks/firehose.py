@@ -0,0 +1,181 @@
+"""Record firehose frames to a file and replay them through the ingestion pipeline at full speed.
+
+Record a fixture from the live relay first, then replay it against the configured database and
+Redis, which should be local and disposable::
+
+    python -m benchmarks.firehose record firehose.bin.gz --events 100000
+    BSKY_HOSTNAME=localhost python -m benchmarks.firehose replay firehose.bin.gz
+
+Frames are stored as received, gzipped and prefixed by their length, so a replay decodes them
+exactly like the live stream does. ``--no-index`` stops after extracting the operations, to
+measure decoding alone without writing anything.
+"""
+import argparse
+import gzip
+import statistics
+import struct
+import time
+
+from atproto import firehose_models, FirehoseSubscribeReposClient, models, parse_subscribe_repos_message
+
+from server import config, data_stream
+
+_LENGTH = struct.Struct('>I')
+
+
+class _RecordingConnection:
+    # Websocket connection handing every binary frame over before the client decodes it
+    def __init__(self, connection, on_frame):
+        self._connection = connection
+        self._on_frame = on_frame
+
+    def __enter__(self):
+        self._connection.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._connection.__exit__(*exc_info)
+
+    def recv(self):
+        raw_frame = self._connection.recv()
+        if isinstance(raw_frame, bytes):
+            self._on_frame(raw_frame)
+        return raw_frame
+
+
+class RecordingClient(FirehoseSubscribeReposClient):
+    """Firehose client passing the raw bytes of every frame to ``on_frame``."""
+
+    def __init__(self, on_frame, params=None):
+        super().__init__(params)
+        self._on_frame = on_frame
+
+    def _get_client(self):
+        return _RecordingConnection(super()._get_client(), self._on_frame)
+
+
+def read_frames(path):
+    with gzip.open(path, 'rb') as file:
+        while header := file.read(_LENGTH.size):
+            yield file.read(_LENGTH.unpack(header)[0])
+
+
+def record(args):
+    params = models.ComAtprotoSyncSubscribeRepos.Params(cursor=args.cursor) if args.cursor else None
+    recorded = 0
+    deadline = time.monotonic() + args.seconds if args.seconds else None
+
+    with gzip.open(args.output, 'wb') as file:
+        def on_frame(raw_frame):
+            nonlocal recorded
+            file.write(_LENGTH.pack(len(raw_frame)))
+            file.write(raw_frame)
+            recorded += 1
+
+        client = RecordingClient(on_frame, params)
+
+        def on_message_handler(_):
+            if recorded >= args.events or (deadline and time.monotonic() >= deadline):
+                client.stop()
+
+        client.start(on_message_handler)
+
+    print(f'Recorded {recorded} frames to {args.output}')
+
+
+def percentiles(timings):
+    if len(timings) < 2:
+        return [timings[0] * 1000] * 3 if timings else [0.0] * 3
+    cuts = statistics.quantiles(timings, n=100)
+    return [cuts[49] * 1000, cuts[94] * 1000, cuts[98] * 1000]
+
+
+def replay(args):
+    indexer = None
+    flush_timings = []
+    if args.index:
+        # Imported here so decoding alone can be measured without loading the language model
+        from server.data_filter import Indexer
+
+        class TimedIndexer(Indexer):
+            def flush(self):
+                start = time.perf_counter()
+                try:
+                    return super().flush()
+                finally:
+                    flush_timings.append(time.perf_counter() - start)
+
+        indexer = TimedIndexer(batch_size=args.batch_size, batch_interval=args.batch_interval)
+
+    stages = {'frame': [], 'parse': [], 'ops': [], 'index': []}
+    events = 0
+
+    start = time.perf_counter()
+    for raw_frame in read_frames(args.input):
+        t0 = time.perf_counter()
+        frame = firehose_models.Frame.from_bytes(raw_frame)
+        t1 = time.perf_counter()
+        stages['frame'].append(t1 - t0)
+
+        # Same filtering as the live stream
+        if (
+            not isinstance(frame, firehose_models.MessageFrame)
+            or frame.type != '#commit'
+            or not frame.body.get('blocks')
+            or not data_stream._has_interesting_ops(frame.body['ops'])
+        ):
+            continue
+
+        commit = parse_subscribe_repos_message(frame)
+        t2 = time.perf_counter()
+        ops = data_stream._get_ops_by_type(commit)
+        t3 = time.perf_counter()
+        stages['parse'].append(t2 - t1)
+        stages['ops'].append(t3 - t2)
+
+        if indexer is not None:
+            indexer(ops, commit.seq)
+            stages['index'].append(time.perf_counter() - t3)
+
+        events += 1
+
+    if indexer is not None:
+        indexer.flush()
+    elapsed = time.perf_counter() - start
+
+    print(f'{events} commits in {elapsed:.2f}s: {events / elapsed:.0f} events/s')
+    print(f"{'stage':>6} {'count':>8} {'total':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for stage, timings in list(stages.items()) + [('flush', flush_timings)]:
+        if not timings:
+            continue
+        p50, p95, p99 = percentiles(timings)
+        print(
+            f'{stage:>6} {len(timings):>8} {sum(timings):>8.2f}s'
+            f' {p50:>7.3f}ms {p95:>7.3f}ms {p99:>7.3f}ms'
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help='Dump raw frames from the live firehose')
+    record_parser.add_argument('output')
+    record_parser.add_argument('--events', type=int, default=100000)
+    record_parser.add_argument('--seconds', type=float, default=None)
+    record_parser.add_argument('--cursor', type=int, default=None)
+    record_parser.set_defaults(run=record)
+
+    replay_parser = subparsers.add_parser('replay', help='Feed recorded frames through the ingestion pipeline')
+    replay_parser.add_argument('input')
+    replay_parser.add_argument('--no-index', dest='index', action='store_false')
+    replay_parser.add_argument('--batch-size', type=int, default=config.INDEXER_BATCH_SIZE)
+    replay_parser.add_argument('--batch-interval', type=float, default=config.INDEXER_BATCH_INTERVAL)
+    replay_parser.set_defaults(run=replay)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-from app import app
+from server.app import app
 
 if __name__ == '__main__':
     # FOR DEBUG PURPOSE ONLY
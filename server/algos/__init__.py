@@ -2,8 +2,11 @@ import server.algos.top_followed.spanish as top_spanish
 from .discover import DiscoverAlgorithm
 from .languages import spanish, catalan, portuguese, galician, basque
 
+top_spanish_algorithm = top_spanish.TopSpanishAlgorithm()
+discover_algorithm = DiscoverAlgorithm()
+
 algos = {
-    top_spanish.uri: top_spanish.TopSpanishAlgorithm().handle,
+    top_spanish.uri: top_spanish_algorithm.handle,
 
     basque.uri: basque.handler,
     catalan.uri: catalan.handler,
@@ -11,5 +14,23 @@ algos = {
     portuguese.uri: portuguese.handler,
     spanish.uri: spanish.handler,
 
-    discover.uri: DiscoverAlgorithm().handle,
+    discover.uri: discover_algorithm.handle,
+}
+
+# Handlers of the async serving mode, see server.asgi
+async_algos = {
+    top_spanish.uri: top_spanish_algorithm.handle_async,
+
+    basque.uri: basque.handler_async,
+    catalan.uri: catalan.handler_async,
+    galician.uri: galician.handler_async,
+    portuguese.uri: portuguese.handler_async,
+    spanish.uri: spanish.handler_async,
+
+    discover.uri: discover_algorithm.handle_async,
+}
+
+# Feeds whose pages depend on the requester
+personalized = {
+    discover.uri,
 }
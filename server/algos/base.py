@@ -1,37 +1,59 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 
-from server.database import Post
-
 CURSOR_EOF = "eof"
 
+_EPOCH = datetime(1970, 1, 1)
+_MILLISECOND = timedelta(milliseconds=1)
 
-def handler(cursor: Optional[str], posts) -> dict:
-    if cursor:
-        if cursor == CURSOR_EOF:
-            return {
-                'cursor': CURSOR_EOF,
-                'feed': []
-            }
-        cursor_parts = cursor.split('::')
-        if len(cursor_parts) != 2:
-            raise ValueError('Malformed cursor')
 
-        created_at, cid = cursor_parts
-        created_at = datetime.fromtimestamp(int(created_at) / 1000)
-        posts = posts.where(
-            (Post.created_at < created_at)
-            | ((Post.created_at == created_at) & (Post.cid < cid))
-        )
+def to_millis(created_at: datetime) -> int:
+    """Milliseconds since the epoch of a creation time, as cursors hold them. Naive datetimes are UTC."""
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return (created_at - _EPOCH) // _MILLISECOND
+
+
+def parse_cursor(cursor: Optional[str]) -> tuple:
+    """Split a cursor into creation time and cid, both ``None`` for the first page.
+
+    The creation time is naive UTC, like the datetimes stored in Postgres.
+
+    Raises:
+        :obj:`ValueError`: If the cursor is malformed.
+    """
+    if not cursor:
+        return None, None
+
+    cursor_parts = cursor.split('::')
+    if len(cursor_parts) != 2:
+        raise ValueError('Malformed cursor')
 
-    feed = [{'post': post.uri} for post in posts]
+    created_at, cid = cursor_parts
+    return _EPOCH + int(created_at) * _MILLISECOND, cid
+
+
+def page(posts: list) -> dict:
+    """Build a feed skeleton out of post rows with ``uri``, ``cid``, ``created_at`` and optionally ``repost_uri``."""
+    feed = []
+    for post in posts:
+        feed_entry = {'post': post['uri']}
+
+        if repost_uri := post.get('repost_uri'):
+            feed_entry['reason'] = {
+                '$type': 'app.bsky.feed.defs#skeletonReasonRepost',
+                'repost': repost_uri,
+            }
+
+        feed.append(feed_entry)
 
     cursor = CURSOR_EOF
     last_post = posts[-1] if posts else None
     if last_post:
-        cursor = f'{int(last_post.created_at.timestamp() * 1000)}::{last_post.cid}'
+        cursor = f'{to_millis(last_post["created_at"])}::{last_post["cid"]}'
 
     return {
         'cursor': cursor,
         'feed': feed
     }
+
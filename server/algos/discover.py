@@ -1,14 +1,16 @@
+import asyncio
 import os
 from datetime import datetime
 from typing import Optional
 
 import peewee
+from atproto_client.client.async_client import AsyncClient
 from atproto_client.client.client import Client
 from peewee import fn
 
-from server import config
+from server import async_db, config, follows
 from server.algos import base
-from server.database import Post, User, Interaction
+from server.database import Post, User, Interaction, PostStats
 from server.utils import nth_item
 
 uri = config.DISCOVER_URI
@@ -16,37 +18,64 @@ uri = config.DISCOVER_URI
 
 class DiscoverAlgorithm:
     def __init__(self, min_likes=2):
-        self.client = Client()
-        self.client.login(
+        self.min_likes = min_likes
+        self._client = None
+        self._async_login = None
+
+    @property
+    def client(self):
+        # Logged in on first use, so the feed queries can be built offline
+        if self._client is None:
+            client = Client()
+            client.login(
+                os.environ.get("STATISTICS_USER"),
+                os.environ.get("STATISTICS_PASSWORD"),
+            )
+            self._client = client
+        return self._client
+
+    async def _login_async(self):
+        client = AsyncClient()
+        await client.login(
             os.environ.get("STATISTICS_USER"),
             os.environ.get("STATISTICS_PASSWORD"),
         )
-        self.min_likes = min_likes
-
-    def _get_posts_from_likes(self, limit, created_at, cid, user_follows_dids, requester_did):
-        InteractionUser = User.alias()
-        PostUser = User.alias()
+        return client
+
+    async def _get_async_client(self):
+        # Concurrent requests share the same login
+        if self._async_login is None:
+            self._async_login = asyncio.ensure_future(self._login_async())
+        try:
+            return await asyncio.shield(self._async_login)
+        except Exception:
+            self._async_login = None
+            raise
+
+    def _get_posts_from_likes(self, limit, created_at, cid, user_follows_ids, requester_id):
+        # A single array parameter keeps the statement small and planning cheap for any amount of follows
+        follows_ids = peewee.Value(user_follows_ids, converter=False, unpack=False)
 
         posts = Post.select(
             Post.id,
             Post.uri,
             Post.cid,
             nth_item(Interaction.created_at, self.min_likes).alias("created_at"),
-            nth_item(InteractionUser.did, self.min_likes).alias("like_by_did"),
         ).join(
             Interaction, on=(Interaction.post == Post.id)
-        ).join(
-            InteractionUser, on=(InteractionUser.id == Interaction.author)
-        ).join(
-            PostUser, on=(PostUser.id == Post.author)
+        ).join_from(
+            Post, PostStats, on=(PostStats.post == Post.id)
         ).where(
+            # Rule out posts without enough likes overall before aggregating them
+            PostStats.like_count >= self.min_likes,
             Post.created_at <= datetime.utcnow(),
+            Interaction.author == fn.ANY(follows_ids),
             Interaction.interaction_type == Interaction.LIKE,
             Interaction.created_at <= datetime.utcnow(),
-            InteractionUser.did.in_(user_follows_dids),
-            PostUser.did != requester_did,
+            Post.author.is_null(False),
+            Post.author != requester_id,
             (
-                    PostUser.did.not_in(user_follows_dids)
+                    (Post.author != fn.ALL(follows_ids))
                     | Post.reply_parent.is_null(False)
             )
         ).group_by(
@@ -68,7 +97,13 @@ class DiscoverAlgorithm:
 
         return posts
 
-    def _get_user_follows_dids(self, requester_did):
+    def _get_user_ids_query(self, dids):
+        return User.select(User.id).where(User.did == fn.ANY(peewee.Value(dids, converter=False, unpack=False)))
+
+    def _get_user_ids(self, dids):
+        return [user_id for user_id, in self._get_user_ids_query(dids).tuples()]
+
+    def _fetch_user_follows_dids(self, requester_did):
         user_follows_dids = []
         cursor = None
         while True:
@@ -82,37 +117,44 @@ class DiscoverAlgorithm:
                 break
         return user_follows_dids
 
+    async def _fetch_user_follows_dids_async(self, requester_did):
+        client = await self._get_async_client()
+
+        user_follows_dids = []
+        cursor = None
+        while True:
+            user_follows_response = await client.get_follows(requester_did, cursor=cursor, limit=100)
+            user_follows_dids.extend([
+                profile_data.did
+                for profile_data in user_follows_response.follows
+            ])
+            cursor = user_follows_response.cursor
+            if not cursor:
+                break
+        return user_follows_dids
+
     def handle(self, cursor: Optional[str], limit: int, requester_did: str) -> dict:
-        user_follows_dids = self._get_user_follows_dids(requester_did)
-        created_at, cid = None, None
-
-        if cursor:
-            if cursor == base.CURSOR_EOF:
-                return {
-                    'cursor': base.CURSOR_EOF,
-                    'feed': []
-                }
-            cursor_parts = cursor.split('::')
-            if len(cursor_parts) != 2:
-                raise ValueError('Malformed cursor')
-
-            created_at, cid = cursor_parts
-            created_at = datetime.fromtimestamp(int(created_at) / 1000)
-
-        posts = self._get_posts_from_likes(limit, created_at, cid, user_follows_dids, requester_did)
-        posts = list(posts.dicts())
-
-        feed = [
-            {'post': post['uri']}
-            for post in posts
-        ]
-
-        cursor = base.CURSOR_EOF
-        last_post = posts[-1] if posts else None
-        if last_post:
-            cursor = f'{int(last_post["created_at"].timestamp() * 1000)}::{last_post["cid"]}'
-
-        return {
-            'cursor': cursor,
-            'feed': feed
-        }
+        if cursor == base.CURSOR_EOF:
+            return base.page([])
+
+        created_at, cid = base.parse_cursor(cursor)
+
+        user_follows_dids = follows.get(requester_did, self._fetch_user_follows_dids)
+        user_follows_ids = self._get_user_ids(user_follows_dids)
+        requester_id = User.select(User.id).where(User.did == requester_did).scalar() or 0
+
+        posts = self._get_posts_from_likes(limit, created_at, cid, user_follows_ids, requester_id)
+        return base.page(list(posts.dicts()))
+
+    async def handle_async(self, cursor: Optional[str], limit: int, requester_did: str) -> dict:
+        if cursor == base.CURSOR_EOF:
+            return base.page([])
+
+        created_at, cid = base.parse_cursor(cursor)
+
+        user_follows_dids = await follows.get_async(requester_did, self._fetch_user_follows_dids_async)
+        user_follows_ids = [row['id'] for row in await async_db.fetch(self._get_user_ids_query(user_follows_dids))]
+        requester_id = await async_db.scalar(User.select(User.id).where(User.did == requester_did)) or 0
+
+        posts = self._get_posts_from_likes(limit, created_at, cid, user_follows_ids, requester_id)
+        return base.page(await async_db.fetch(posts))
@@ -12,3 +12,11 @@ def handler(cursor: Optional[str], limit: int, requester_did: str) -> dict:
         cursor=cursor,
         limit=limit,
     )
+
+
+async def handler_async(cursor: Optional[str], limit: int, requester_did: str) -> dict:
+    return await algo_languages.handler_async(
+        language_code="gl",
+        cursor=cursor,
+        limit=limit,
+    )
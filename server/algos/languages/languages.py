@@ -1,16 +1,38 @@
 from datetime import datetime
 from typing import Optional
 
+from server import async_db, feed_index, metrics
 from server.algos import base
-from server.database import Post, Language
+from server.database import Post, Language, PostLanguage
 
-CURSOR_EOF = "eof"
+# Pages the Redis index can't answer fall back to Postgres
+_INDEX_HITS = metrics.CACHE_LOOKUPS.labels('feed_index', 'hit')
+_INDEX_MISSES = metrics.CACHE_LOOKUPS.labels('feed_index', 'miss')
 
 
-def handler(language_code: str, cursor: Optional[str], limit: int) -> dict:
-    language = Language.get(Language.code == language_code)
+def _index_page(posts):
+    cursor = base.CURSOR_EOF
+    if posts:
+        last_created_at, last_cid, _ = posts[-1]
+        cursor = f'{last_created_at}::{last_cid}'
+
+    return {
+        'cursor': cursor,
+        'feed': [{'post': uri} for _, _, uri in posts],
+    }
 
-    posts = language.posts.where(
+
+def _get_posts(language_code, created_at, cid, limit):
+    posts = Post.select(
+        Post.uri,
+        Post.cid,
+        Post.created_at,
+    ).join(
+        PostLanguage, on=(PostLanguage.post == Post.id)
+    ).join(
+        Language, on=(Language.id == PostLanguage.language)
+    ).where(
+        Language.code == language_code,
         Post.reply_root.is_null(True),
         Post.created_at <= datetime.utcnow(),
     ).order_by(
@@ -18,4 +40,40 @@ def handler(language_code: str, cursor: Optional[str], limit: int) -> dict:
         Post.cid.desc(),
     ).limit(limit)
 
-    return base.handler(cursor, posts)
+    if created_at:
+        posts = posts.where(
+            (Post.created_at < created_at)
+            | ((Post.created_at == created_at) & (Post.cid < cid))
+        )
+    return posts
+
+
+def handler(language_code: str, cursor: Optional[str], limit: int) -> dict:
+    if cursor == base.CURSOR_EOF:
+        return base.page([])
+
+    created_at, cid = base.parse_cursor(cursor)
+
+    # Served from the Redis index, Postgres only covers cold starts and pages past its end
+    posts = feed_index.page(language_code, base.to_millis(created_at) if created_at else None, cid, limit)
+    if posts is not None:
+        _INDEX_HITS.inc()
+        return _index_page(posts)
+
+    _INDEX_MISSES.inc()
+    return base.page(list(_get_posts(language_code, created_at, cid, limit).dicts()))
+
+
+async def handler_async(language_code: str, cursor: Optional[str], limit: int) -> dict:
+    if cursor == base.CURSOR_EOF:
+        return base.page([])
+
+    created_at, cid = base.parse_cursor(cursor)
+
+    posts = await feed_index.page_async(language_code, base.to_millis(created_at) if created_at else None, cid, limit)
+    if posts is not None:
+        _INDEX_HITS.inc()
+        return _index_page(posts)
+
+    _INDEX_MISSES.inc()
+    return base.page(await async_db.fetch(_get_posts(language_code, created_at, cid, limit)))
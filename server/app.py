@@ -1,44 +1,33 @@
-import sys
-import signal
-import threading
+import time
 
-from server import config, data_stream
-from server.auth import AuthorizationError, validate_auth
-from server.tasks import cleaner, statistics
-
-from flask import Flask, jsonify, request
+from flask import Flask, g, jsonify, request
 
-from server.algos import algos
-from server.data_filter import operations_callback
+from server import config, metrics, page_cache
+from server.algos import algos, personalized
+from server.auth import AuthorizationError, validate_auth
+from server.database import db
 
 app = Flask(__name__)
 
-stop_event = threading.Event()
-
-# Stream thread
-threading.Thread(
-    target=data_stream.run, args=(config.SERVICE_DID, operations_callback, stop_event,)
-).start()
 
-# Cleaner thread
-threading.Thread(
-    target=cleaner.run, args=(stop_event,)
-).start()
+@app.before_request
+def db_connect():
+    g.started_at = time.perf_counter()
+    db.connect(reuse_if_open=True)
 
-# Statistics update thread
-statistics_updater = statistics.StatisticsUpdater()
-threading.Thread(
-    target=statistics_updater.run, args=(stop_event,)
-).start()
 
+@app.after_request
+def record_latency(response):
+    # Unmatched paths share a label, so they can't blow up the number of series
+    metrics.HTTP_REQUEST_SECONDS.labels(request.endpoint or 'other', response.status_code).observe(time.perf_counter() - g.started_at)
+    return response
 
-def sigint_handler(*_):
-    print('Stopping sub-threads...')
-    stop_event.set()
-    sys.exit(0)
 
-
-signal.signal(signal.SIGINT, sigint_handler)
+@app.teardown_request
+def db_close(_):
+    # Hand the connection back to the pool
+    if not db.is_closed():
+        db.close()
 
 
 @app.route('/')
@@ -46,6 +35,12 @@ def index():
     return 'ATProto Feed Generator powered by The AT Protocol SDK for Python (https://github.com/MarshalX/atproto).'
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    body, content_type = metrics.render()
+    return body, 200, {'Content-Type': content_type}
+
+
 @app.route('/.well-known/did.json', methods=['GET'])
 def did_json():
     if not config.SERVICE_DID.endswith(config.HOSTNAME):
@@ -92,7 +87,14 @@ def get_feed_skeleton():
     try:
         cursor = request.args.get('cursor', default=None, type=str)
         limit = request.args.get('limit', default=20, type=int)
-        body = algo(cursor, limit, requester_did)
+        with metrics.timed(metrics.FEED_REQUEST_SECONDS.labels(feed)):
+            body = page_cache.get(
+                feed,
+                cursor,
+                limit,
+                requester_did if feed in personalized else None,
+                lambda: algo(cursor, limit, requester_did),
+            )
     except ValueError:
         return 'Malformed cursor', 400
 
@@ -0,0 +1,131 @@
+"""Async feed server.
+
+Run with ``python -m server.asgi``, it serves feeds from ``WEB_WORKERS`` uvicorn processes with a
+single event loop each. Database reads go through an asyncpg pool, Redis and the AT Protocol
+through their async clients, so a worker keeps serving while requests wait on I/O.
+"""
+import contextlib
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+from server import async_db, config, metrics, page_cache
+from server.algos import async_algos, personalized
+from server.auth import AuthorizationError, validate_auth_async
+
+
+async def index(request: Request):
+    return PlainTextResponse(
+        'ATProto Feed Generator powered by The AT Protocol SDK for Python (https://github.com/MarshalX/atproto).'
+    )
+
+
+async def get_metrics(request: Request):
+    body, content_type = metrics.render()
+    return Response(body, headers={'Content-Type': content_type})
+
+
+async def did_json(request: Request):
+    if not config.SERVICE_DID.endswith(config.HOSTNAME):
+        return PlainTextResponse('', 404)
+
+    return JSONResponse({
+        '@context': ['https://www.w3.org/ns/did/v1'],
+        'id': config.SERVICE_DID,
+        'service': [
+            {
+                'id': '#bsky_fg',
+                'type': 'BskyFeedGenerator',
+                'serviceEndpoint': f'https://{config.HOSTNAME}'
+            }
+        ]
+    })
+
+
+async def describe_feed_generator(request: Request):
+    feeds = [{'uri': uri} for uri in async_algos.keys()]
+    response = {
+        'encoding': 'application/json',
+        'body': {
+            'did': config.SERVICE_DID,
+            'feeds': feeds
+        }
+    }
+    return JSONResponse(response)
+
+
+async def get_feed_skeleton(request: Request):
+    feed = request.query_params.get('feed')
+    algo = async_algos.get(feed)
+    if not algo:
+        return PlainTextResponse('Unsupported algorithm', 400)
+
+    try:
+        requester_did = await validate_auth_async(request.headers)
+    except AuthorizationError:
+        return PlainTextResponse('Unauthorized', 401)
+
+    try:
+        limit = int(request.query_params.get('limit', 20))
+    except ValueError:
+        return PlainTextResponse('Malformed limit', 400)
+
+    try:
+        cursor = request.query_params.get('cursor')
+        with metrics.timed(metrics.FEED_REQUEST_SECONDS.labels(feed)):
+            body = await page_cache.get_async(
+                feed,
+                cursor,
+                limit,
+                requester_did if feed in personalized else None,
+                lambda: algo(cursor, limit, requester_did),
+            )
+    except ValueError:
+        return PlainTextResponse('Malformed cursor', 400)
+
+    return JSONResponse(body)
+
+
+async def record_latency(request: Request, call_next):
+    started_at = time.perf_counter()
+    response = await call_next(request)
+
+    # Unmatched paths share a label, so they can't blow up the number of series
+    endpoint = request.scope.get('endpoint')
+    endpoint = endpoint.__name__ if endpoint else 'other'
+    metrics.HTTP_REQUEST_SECONDS.labels(endpoint, response.status_code).observe(time.perf_counter() - started_at)
+    return response
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_):
+    await async_db.connect()
+    yield
+    await async_db.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/', index),
+        Route('/metrics', get_metrics),
+        Route('/.well-known/did.json', did_json),
+        Route('/xrpc/app.bsky.feed.describeFeedGenerator', describe_feed_generator),
+        Route('/xrpc/app.bsky.feed.getFeedSkeleton', get_feed_skeleton),
+    ],
+    middleware=[Middleware(BaseHTTPMiddleware, dispatch=record_latency)],
+    lifespan=lifespan,
+)
+
+
+def main():
+    uvicorn.run('server.asgi:app', host='0.0.0.0', port=config.WEB_PORT, workers=config.WEB_WORKERS)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Runs peewee read queries on an asyncpg connection pool, for the async serving mode.
+
+Queries are still built with the models in :obj:`server.database`, only their SQL is sent through
+asyncpg instead of psycopg2.
+"""
+import asyncpg
+
+from server import config, metrics
+from server.database import db
+
+_pool = None
+
+
+async def connect() -> None:
+    global _pool
+    _pool = await asyncpg.create_pool(
+        database=db.database,
+        user=db.connect_params['user'],
+        password=db.connect_params['password'],
+        host=db.connect_params['host'],
+        port=db.connect_params['port'],
+        max_size=config.DB_MAX_CONNECTIONS,
+    )
+
+
+async def close() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def _to_asyncpg(query):
+    sql, params = query.sql()
+
+    # psycopg2 placeholders to numbered ones. NULL is inlined, as "IS NULL" doesn't take parameters.
+    parts = sql.split('%s')
+    statement, args = [parts[0]], []
+    for part, param in zip(parts[1:], params):
+        if param is None:
+            statement.append('NULL')
+        else:
+            args.append(param)
+            statement.append(f'${len(args)}')
+        statement.append(part)
+
+    return ''.join(statement).replace('%%', '%'), args
+
+
+async def fetch(query) -> list:
+    """Run a select query.
+
+    Returns:
+        :obj:`list`: Rows as dicts, keyed like ``query.dicts()`` rows.
+    """
+    statement, args = _to_asyncpg(query)
+    with metrics.timed(metrics.DB_QUERY_SECONDS.labels(metrics.statement(statement))):
+        return [dict(row) for row in await _pool.fetch(statement, *args)]
+
+
+async def scalar(query):
+    statement, args = _to_asyncpg(query)
+    with metrics.timed(metrics.DB_QUERY_SECONDS.labels(metrics.statement(statement))):
+        return await _pool.fetchval(statement, *args)
@@ -0,0 +1,83 @@
+from collections import OrderedDict
+
+from server import metrics
+
+
+class LRUCache:
+    """Bounded mapping evicting the least recently used keys, counting hits and misses.
+
+    Named caches also report their lookups to :obj:`server.metrics.CACHE_LOOKUPS`.
+    """
+
+    def __init__(self, max_size, name=None):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._data = OrderedDict()
+        self._hit_counter = metrics.CACHE_LOOKUPS.labels(name, 'hit') if name else None
+        self._miss_counter = metrics.CACHE_LOOKUPS.labels(name, 'miss') if name else None
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self._count(0, 1)
+            return default
+
+        self._data.move_to_end(key)
+        self._count(1, 0)
+        return value
+
+    def get_many(self, keys):
+        """Look up several keys at once.
+
+        Returns:
+            :obj:`tuple`: Mapping of the keys found and list of the missing ones.
+        """
+        found, missing = {}, []
+        for key in keys:
+            try:
+                found[key] = self._data[key]
+                self._data.move_to_end(key)
+            except KeyError:
+                missing.append(key)
+
+        self._count(len(found), len(missing))
+        return found, missing
+
+    def _count(self, hits, misses):
+        self.hits += hits
+        self.misses += misses
+        if self._hit_counter is not None:
+            if hits:
+                self._hit_counter.inc(hits)
+            if misses:
+                self._miss_counter.inc(misses)
+
+    def set(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def set_many(self, items):
+        for key, value in items.items():
+            self.set(key, value)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
@@ -0,0 +1,62 @@
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from server import config, metrics
+from server.database import SubscriptionState
+from server.logger import logger
+
+
+class Checkpointer:
+    """Persists the firehose cursor of a service as written events pile up.
+
+    The cursor only ever receives the watermark of written commits, so it's stored after the rows
+    it covers. It's committed once ``every_events`` events have been written since the previous
+    checkpoint or ``every_seconds`` have passed, whatever comes first.
+
+    ``lag`` holds the ingestion lag in seconds: wall clock minus the ``time`` of the last written
+    event.
+    """
+
+    def __init__(self, name, cursor, every_events=config.CHECKPOINT_EVENTS, every_seconds=config.CHECKPOINT_INTERVAL):
+        self.name = name
+        self.cursor = cursor
+        self.every_events = every_events
+        self.every_seconds = every_seconds
+        self.lag = None
+
+        self._committed_at = time.monotonic()
+        self._event_times = deque()
+
+    def observe(self, seq, event_time):
+        self._event_times.append((seq, event_time))
+
+    def advance(self, watermark):
+        """Move the cursor to ``watermark`` and store it if a checkpoint is due.
+
+        Returns:
+            :obj:`bool`: Whether the cursor has been stored.
+        """
+        if watermark is None or watermark <= self.cursor:
+            return False
+
+        event_time = None
+        while self._event_times and self._event_times[0][0] <= watermark:
+            _, event_time = self._event_times.popleft()
+        if event_time:
+            self.lag = (datetime.now(timezone.utc) - datetime.fromisoformat(event_time)).total_seconds()
+            metrics.FIREHOSE_LAG.set(self.lag)
+
+        if watermark - self.cursor < self.every_events and time.monotonic() - self._committed_at < self.every_seconds:
+            return False
+
+        self.commit(watermark)
+        return True
+
+    def commit(self, cursor):
+        SubscriptionState.update(cursor=cursor).where(SubscriptionState.service == self.name).execute()
+        self.cursor = cursor
+        self._committed_at = time.monotonic()
+
+        lag = f'{self.lag:.1f}s' if self.lag is not None else 'unknown'
+        logger.info(f'Updated cursor for {self.name} to {cursor} (lag {lag})')
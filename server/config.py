@@ -1,5 +1,10 @@
 import os
 
+from dotenv import load_dotenv
+
+# Entry points other than the Flask CLI need the .env file loaded too
+load_dotenv()
+
 SERVICE_DID = os.environ.get('SERVICE_DID', None)
 HOSTNAME = os.environ.get('BSKY_HOSTNAME', None)
 
@@ -18,3 +23,84 @@ PORTUGUESE_URI = os.environ.get('PORTUGUESE_URI')
 SPANISH_URI = os.environ.get('SPANISH_URI')
 
 DISCOVER_URI = os.environ.get('DISCOVER_URI')
+
+LANGUAGE_FEEDS = {
+    'eu': BASQUE_URI,
+    'ca': CATALAN_URI,
+    'gl': GALICIAN_URI,
+    'pt': PORTUGUESE_URI,
+    'es': SPANISH_URI,
+}
+
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', 7))
+
+# Days ahead daily interaction partitions are created for
+PARTITION_DAYS_AHEAD = int(os.environ.get('PARTITION_DAYS_AHEAD', 7))
+
+# The cleaner deletes expired posts in chunks of this many ids, pausing this many seconds between chunks
+CLEANER_CHUNK_SIZE = int(os.environ.get('CLEANER_CHUNK_SIZE', 10000))
+CLEANER_CHUNK_PAUSE = float(os.environ.get('CLEANER_CHUNK_PAUSE', 0.5))
+
+# Seconds between the start of two cleaner passes
+CLEANER_INTERVAL = float(os.environ.get('CLEANER_INTERVAL', 600))
+
+# Number of worker processes decoding and indexing firehose commits (1 keeps everything in the stream thread)
+FIREHOSE_WORKERS = int(os.environ.get('FIREHOSE_WORKERS', 1))
+
+# Indexer micro-batches are written once they hold this many records, or this many seconds after they started
+INDEXER_BATCH_SIZE = int(os.environ.get('INDEXER_BATCH_SIZE', 500))
+INDEXER_BATCH_INTERVAL = float(os.environ.get('INDEXER_BATCH_INTERVAL', 1))
+
+# Authors whose user id the indexer keeps in memory
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 500000))
+
+# Posts shorter than this (once normalized) keep their declared languages without running the model
+LANGUAGE_DETECTION_MIN_LENGTH = int(os.environ.get('LANGUAGE_DETECTION_MIN_LENGTH', 12))
+
+# Deletions are applied once this many URIs are pending, or this many seconds after the first of them
+DELETE_BATCH_SIZE = int(os.environ.get('DELETE_BATCH_SIZE', 1000))
+DELETE_BATCH_INTERVAL = float(os.environ.get('DELETE_BATCH_INTERVAL', 5))
+
+# The firehose cursor is stored once this many events have been written, or after this many seconds
+CHECKPOINT_EVENTS = int(os.environ.get('CHECKPOINT_EVENTS', 1000))
+CHECKPOINT_INTERVAL = float(os.environ.get('CHECKPOINT_INTERVAL', 5))
+
+# Root posts kept per language in the Redis feed index
+LANGUAGE_FEED_SIZE = int(os.environ.get('LANGUAGE_FEED_SIZE', 50000))
+
+# Likes a post needs to be featured by like milestone feeds
+LIKES_MILESTONE = int(os.environ.get('LIKES_MILESTONE', 20))
+
+# Followers an author needs for their posts and reposts to be featured by the top followed feeds
+TOP_ACCOUNT_FOLLOWERS = int(os.environ.get('TOP_ACCOUNT_FOLLOWERS', 500))
+
+# Seconds follow lists are cached for the Discover feed, and after which they are refreshed in the background
+FOLLOWS_CACHE_TTL = int(os.environ.get('FOLLOWS_CACHE_TTL', 86400))
+FOLLOWS_REFRESH_INTERVAL = int(os.environ.get('FOLLOWS_REFRESH_INTERVAL', 3600))
+
+# Seconds feed pages are cached for, head pages of the shared feeds are also dropped as new posts land
+PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 5))
+
+# Web server port, worker processes and threads per worker
+WEB_PORT = int(os.environ.get('WEB_PORT', 3333))
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', 4))
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
+
+# Postgres connections each process keeps open at most, per pool
+DB_MAX_CONNECTIONS = int(os.environ.get('DB_MAX_CONNECTIONS', 32))
+
+# Verified auth tokens kept until they expire, and seconds tokens without expiration are kept for
+AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', 100000))
+AUTH_CACHE_MAX_TTL = int(os.environ.get('AUTH_CACHE_MAX_TTL', 300))
+
+# DID documents kept for auth, refreshed in the background once stale and resolved again once expired (seconds)
+DID_CACHE_SIZE = int(os.environ.get('DID_CACHE_SIZE', 100000))
+DID_CACHE_STALE_TTL = int(os.environ.get('DID_CACHE_STALE_TTL', 3600))
+DID_CACHE_MAX_TTL = int(os.environ.get('DID_CACHE_MAX_TTL', 86400))
+
+# Port ingestion and background workers expose their Prometheus metrics on, web servers use /metrics instead
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 8000))
+
+# Concurrent getProfiles calls of the statistics updater, and the calls per second they share
+STATISTICS_CONCURRENCY = int(os.environ.get('STATISTICS_CONCURRENCY', 4))
+STATISTICS_RATE_LIMIT = float(os.environ.get('STATISTICS_RATE_LIMIT', 5))
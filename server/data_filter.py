@@ -1,34 +1,56 @@
-from collections import defaultdict
-from datetime import datetime
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
 from itertools import cycle, chain
 
 from atproto import models
-from dateutil import parser
 from ftlangdetect.detect import get_or_load_model
+from peewee import EXCLUDED, Case, ValuesList, fn
 from redis import Redis
+from redis.exceptions import NoScriptError, RedisError
 
-from server.database import db, Post, Language, User, Interaction
+from server import config, feed_index, follows, metrics, page_cache, timelines
+from server.cache import LRUCache
+from server.database import db, Post, Language, User, Interaction, PostLanguage, PostStats
+from server.logger import logger
 from server.tasks import statistics
-from server.utils import remove_emoji, remove_links
+from server.utils import normalize_text
 
 redis = Redis(host="redis")
 
+# DID -> User.id for recently seen authors, code -> Language.id for every language
+_user_ids = LRUCache(config.USER_CACHE_SIZE, 'users')
+# Next time the statistics of an author are due and their followers, so up to date authors aren't enqueued
+_user_updates = LRUCache(config.USER_CACHE_SIZE, 'user_updates')
+_language_ids = {}
+
+_CACHE_STATS_INTERVAL = 1000
+
+# A batch failing this many times in a row is written record by record, to single out records that can't be
+_WRITE_ATTEMPTS = 3
+# Longest wait before retrying a failed batch, doubling from one second
+_MAX_RETRY_DELAY = 60
+
+_STAGE_SECONDS = {
+    stage: metrics.INGEST_STAGE_SECONDS.labels(stage)
+    for stage in ('language_detection', 'db_write', 'redis')
+}
+
+# Enqueued authors aren't checked again for this long, the statistics worker should be done with them by then
+_STATISTICS_RETRY = timedelta(hours=1)
+# Head start of popular authors in the statistics queue, as their followers decide top followed feed membership
+_STATISTICS_PRIORITY = timedelta(days=1)
 
-def detect_language(text, user_languages):
-    user_languages = map(str.lower, user_languages)
-    user_languages = [
-        language.split("-")[0] for language in user_languages
-    ]
 
-    text = text.replace('\n', '. ').strip()
-    text = remove_emoji(text)
-    text = remove_links(text)
+def _normalize_user_languages(user_languages):
+    return [
+        language.lower().split("-")[0] for language in user_languages
+    ]
 
-    if not text:
-        return user_languages
 
-    model = get_or_load_model(low_memory=False)
-    labels, scores = model.predict(text, k=5)
+def _select_languages(user_languages, labels, scores):
     language_prob = {
         lang.replace("__label__", ''): score
         for lang, score in zip(labels, scores)
@@ -49,119 +71,653 @@ def detect_language(text, user_languages):
     best_match = labels[0].replace("__label__", '')
     best_score = scores[0]
     if best_score > 0.7:
-        return best_match
+        return [best_match]
 
     # Language uncertain
     return []
 
 
-def operations_callback(ops: defaultdict) -> None:
-    _process_posts(ops)
-    _process_interactions(ops)
+def detect_languages(texts, users_languages):
+    """Detect the languages of a batch of posts.
 
+    Args:
+        texts: Post texts.
+        users_languages: Languages declared by the author of each post.
 
-def _get_or_create_author(op, update_statistics=False):
-    author_did = op["author"]
-    author, _ = User.get_or_create(
-        did=author_did
-    )
-    if update_statistics and not redis.sismember(statistics.QUEUE_INDEX, author_did):
-        redis.sadd(statistics.QUEUE_INDEX, author_did)
-        redis.lpush(statistics.QUEUE_NAME, author_did)
-    return author
-
-
-def _get_or_create_post(post_uri, post_cid):
-    post, created = Post.get_or_create(
-        uri=post_uri,
-        defaults={
-            "cid": post_cid,
-            "created_at": datetime.utcnow(),
+    Returns:
+        :obj:`list`: Detected language codes for each post.
+    """
+    users_languages = [_normalize_user_languages(languages) for languages in users_languages]
+    results = list(users_languages)
+
+    to_predict = []
+    for i, (text, user_languages) in enumerate(zip(texts, users_languages)):
+        text = normalize_text(text)
+
+        # Nothing left to detect, or too short for the model to beat the declared languages
+        if not text or (user_languages and len(text) < config.LANGUAGE_DETECTION_MIN_LENGTH):
+            continue
+
+        to_predict.append((i, text))
+
+    if to_predict:
+        model = get_or_load_model(low_memory=False)
+        labels, scores = model.predict([text for _, text in to_predict], k=5)
+        for (i, _), text_labels, text_scores in zip(to_predict, labels, scores):
+            results[i] = _select_languages(users_languages[i], text_labels, text_scores)
+
+    return results
+
+
+def detect_language(text, user_languages):
+    return detect_languages([text], [user_languages])[0]
+
+
+class Indexer:
+    """Gathers operations across commits and writes them in micro-batches.
+
+    A batch is flushed once it holds ``batch_size`` records or ``batch_interval`` seconds after its
+    first commit, whatever comes first. Each flush is a single transaction made of one multi-row
+    ``INSERT ... ON CONFLICT`` per table. Deletions are handed over to a :obj:`DeleteStage` instead.
+
+    A batch failing to be written stays pending, along with its commits, and is retried by later
+    flushes with an exponential backoff. Once it failed ``_WRITE_ATTEMPTS`` times its records are
+    written one by one, and those still failing while the database is reachable are dropped.
+    """
+
+    def __init__(self, batch_size=config.INDEXER_BATCH_SIZE, batch_interval=config.INDEXER_BATCH_INTERVAL):
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+
+        self._posts = {}
+        self._interactions = {}
+        self._follows = []
+        self._unfollows = []
+        self._seqs = []
+        self._written = []
+        self._started_at = None
+        self._failures = 0
+        self._retry_at = 0
+        self._flushes = 0
+        self._timings = defaultdict(float)
+        self._deletes = None
+
+    def __len__(self):
+        return len(self._posts) + len(self._interactions)
+
+    def __call__(self, ops: defaultdict, seq=None) -> list:
+        """Add the operations of a commit to the current batch.
+
+        Returns:
+            :obj:`list`: Sequence numbers of the commits fully written since the previous call.
+        """
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+
+        posts_to_delete = _process_posts(ops, self._posts)
+        interactions_to_delete = _process_interactions(ops, self._interactions)
+        _process_follows(ops, self._follows, self._unfollows)
+        if posts_to_delete or interactions_to_delete:
+            if self._deletes is None:
+                self._deletes = DeleteStage()
+                self._deletes.start()
+            self._deletes.submit(seq, posts_to_delete, interactions_to_delete)
+        if seq is not None:
+            self._seqs.append(seq)
+
+        now = time.monotonic()
+        if now >= self._retry_at and (len(self) >= self.batch_size or now - self._started_at >= self.batch_interval):
+            return self.flush()
+        return self._release()
+
+    def flush(self) -> list:
+        """Write the current batch.
+
+        Returns:
+            :obj:`list`: Sequence numbers of the commits fully written since the previous call.
+        """
+        seqs, self._seqs = self._seqs, []
+        posts, self._posts = self._posts, {}
+        interactions, self._interactions = self._interactions, {}
+        created_follows, self._follows = self._follows, []
+        deleted_follows, self._unfollows = self._unfollows, []
+        self._started_at = None
+
+        # Redis side effects of the whole batch go out in one round trip once the rows are committed
+        pipe = redis.pipeline(transaction=False)
+
+        if posts or interactions:
+            try:
+                self._write_batch(posts, interactions, pipe)
+                posts, interactions = {}, {}
+            except Exception:
+                self._failures += 1
+                logger.exception(
+                    f'Error writing batch of {len(posts)} posts and {len(interactions)} interactions '
+                    f'(attempt {self._failures})'
+                )
+                if self._failures >= _WRITE_ATTEMPTS:
+                    posts, interactions = self._write_each(posts, interactions, pipe)
+
+            if posts or interactions:
+                self._defer(seqs, posts, interactions)
+                seqs = []
+            else:
+                self._failures = 0
+
+        self._written.extend(seqs)
+
+        if created_follows or deleted_follows:
+            try:
+                follows.update(created_follows, deleted_follows, pipe)
+            except RedisError:
+                logger.exception('Error loading the follows scripts')
+
+        commands = len(pipe)
+        redis_started_at = time.monotonic()
+        try:
+            pipe.execute()
+        except NoScriptError:
+            # Only the follows of this batch are lost, the rest of the commands were still run
+            logger.exception('Redis lost the follows scripts, loading them again')
+            follows.forget_scripts()
+        except Exception:
+            logger.exception(f'Error sending {commands} Redis commands')
+        self._record('redis', time.monotonic() - redis_started_at)
+        self._timings['redis_commands'] += commands
+
+        self._flushes += 1
+        if self._flushes % _CACHE_STATS_INTERVAL == 0:
+            logger.info(f'User cache hit rate {_user_ids.hit_rate:.1%} ({len(_user_ids)} entries)')
+            self._log_timings()
+
+        return self._release()
+
+    def _write_batch(self, posts, interactions, pipe):
+        """Write posts and interactions in one transaction, queueing their Redis side effects on ``pipe`` once committed."""
+        started_at = time.monotonic()
+        try:
+            # Detect languages of the whole batch at once
+            languages = detect_languages(
+                [post['text'] for post in posts.values()],
+                [post['langs'] for post in posts.values()],
+            )
+            for post, post_languages in zip(posts.values(), languages):
+                post['languages'] = set(post_languages)
+            detected_at = time.monotonic()
+            self._record('language_detection', detected_at - started_at)
+
+            with db.atomic():
+                featured, statistics_due = _write(posts, interactions)
+            self._record('db_write', time.monotonic() - detected_at)
+        except Exception:
+            # ids created by the rolled back transaction may have been cached
+            _user_ids.clear()
+            _user_updates.clear()
+            _language_ids.clear()
+            raise
+
+        _index_feeds(posts, featured, pipe)
+        # Authors already queued keep their place
+        if statistics_due:
+            pipe.zadd(statistics.QUEUE_NAME, statistics_due, nx=True)
+
+    def _write_each(self, posts, interactions, pipe):
+        """Write the records of a batch that keeps failing one at a time.
+
+        Returns:
+            :obj:`tuple`: Posts and interactions left to retry, none if the failing ones were dropped.
+        """
+        failed_posts, failed_interactions = {}, {}
+        for uri, post in posts.items():
+            try:
+                self._write_batch({uri: post}, {}, pipe)
+            except Exception:
+                failed_posts[uri] = post
+        for uri, interaction in interactions.items():
+            try:
+                self._write_batch({}, {uri: interaction}, pipe)
+            except Exception:
+                failed_interactions[uri] = interaction
+
+        if (failed_posts or failed_interactions) and _database_available():
+            logger.error(
+                f'Dropping {len(failed_posts)} posts and {len(failed_interactions)} interactions failing to be written: '
+                f'{", ".join(list(failed_posts)[:5] + list(failed_interactions)[:5])}'
+            )
+            return {}, {}
+        return failed_posts, failed_interactions
+
+    def _defer(self, seqs, posts, interactions):
+        # Nothing was gathered since the batch was taken, so it becomes the pending batch again
+        self._seqs = seqs
+        self._posts = posts
+        self._interactions = interactions
+        self._started_at = time.monotonic()
+        self._retry_at = self._started_at + min(2 ** (self._failures - 1), _MAX_RETRY_DELAY)
+
+    def _record(self, stage, seconds):
+        self._timings[stage] += seconds
+        _STAGE_SECONDS[stage].observe(seconds)
+
+    def _log_timings(self):
+        timings, self._timings = self._timings, defaultdict(float)
+        logger.info(
+            f'Average flush of the last {_CACHE_STATS_INTERVAL}: '
+            f'detect {timings["language_detection"] / _CACHE_STATS_INTERVAL * 1000:.1f}ms, '
+            f'write {timings["db_write"] / _CACHE_STATS_INTERVAL * 1000:.1f}ms, '
+            f'redis {timings["redis"] / _CACHE_STATS_INTERVAL * 1000:.1f}ms '
+            f'({timings["redis_commands"] / _CACHE_STATS_INTERVAL:.1f} commands)'
+        )
+
+    def _release(self):
+        # Written commits are only reported once the deletions submitted before them are applied too
+        oldest_pending = self._deletes.oldest_pending() if self._deletes else None
+        if oldest_pending is None:
+            released, self._written = self._written, []
+        else:
+            # Not in order after a reconnect, commits since the last stored cursor are replayed
+            released = [seq for seq in self._written if seq < oldest_pending]
+            self._written = [seq for seq in self._written if seq >= oldest_pending]
+        return released
+
+
+class DeleteStage(threading.Thread):
+    """Applies deletions in bulk on its own thread and connection, off the insert path.
+
+    URIs are batched across commits until ``batch_size`` of them are pending or ``batch_interval``
+    seconds have passed, then deleted with one statement per table, dependent
+    ``post_language_through`` rows first.
+
+    A batch failing to be deleted keeps its commits pending and is retried with an exponential
+    backoff, gathering the URIs submitted meanwhile. Once it failed ``_WRITE_ATTEMPTS`` times it is
+    dropped, unless the database is unreachable.
+    """
+
+    def __init__(self, batch_size=config.DELETE_BATCH_SIZE, batch_interval=config.DELETE_BATCH_INTERVAL):
+        super().__init__(daemon=True)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+
+        self._queue = queue.Queue()
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def submit(self, seq, post_uris, interaction_uris):
+        with self._lock:
+            self._pending.append(seq)
+        self._queue.put((post_uris, interaction_uris))
+
+    def oldest_pending(self):
+        """Sequence number of the oldest commit whose deletions are not applied yet."""
+        with self._lock:
+            return self._pending[0] if self._pending else None
+
+    def run(self):
+        post_uris, interaction_uris, submitted = [], [], 0
+        failures = 0
+        while True:
+            if not submitted:
+                post_uris, interaction_uris = self._queue.get()
+                submitted = 1
+
+            deadline = time.monotonic() + self.batch_interval
+            while len(post_uris) + len(interaction_uris) < self.batch_size:
+                try:
+                    more_post_uris, more_interaction_uris = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                post_uris = post_uris + more_post_uris
+                interaction_uris = interaction_uris + more_interaction_uris
+                submitted += 1
+
+            try:
+                with db.atomic():
+                    deleted_posts = _delete(post_uris, interaction_uris)
+                feed_index.remove(deleted_posts)
+            except Exception:
+                failures += 1
+                logger.exception(
+                    f'Error deleting {len(post_uris)} posts and {len(interaction_uris)} interactions '
+                    f'(attempt {failures})'
+                )
+                if failures < _WRITE_ATTEMPTS or not _database_available():
+                    time.sleep(min(2 ** (failures - 1), _MAX_RETRY_DELAY))
+                    continue
+                logger.error(f'Dropped deletion of {len(post_uris)} posts and {len(interaction_uris)} interactions')
+
+            failures = 0
+            with self._lock:
+                for _ in range(submitted):
+                    self._pending.popleft()
+                metrics.QUEUE_DEPTH.labels('deletes').set(len(self._pending))
+            post_uris, interaction_uris, submitted = [], [], 0
+
+
+def _delete(post_uris, interaction_uris):
+    if interaction_uris:
+        deleted = Interaction.delete().where(
+            Interaction.uri.in_(interaction_uris)
+        ).returning(Interaction.post, Interaction.interaction_type).tuples().execute()
+
+        deltas = {}
+        for post_id, interaction_type in deleted:
+            post_deltas = deltas.setdefault(post_id, [0, 0])
+            post_deltas[interaction_type] += 1
+
+        if deltas:
+            values = ValuesList(
+                [(post_id, likes, reposts) for post_id, (likes, reposts) in sorted(deltas.items())],
+                columns=('post_id', 'likes', 'reposts'),
+                alias='deltas',
+            )
+            PostStats.update(
+                like_count=PostStats.like_count - values.c.likes,
+                repost_count=PostStats.repost_count - values.c.reposts,
+            ).from_(values).where(PostStats.post == values.c.post_id).execute()
+
+    if post_uris:
+        PostLanguage.delete().where(
+            PostLanguage.post.in_(Post.select(Post.id).where(Post.uri.in_(post_uris)))
+        ).execute()
+        # Interactions on the deleted posts go away through their ON DELETE CASCADE
+        return list(Post.delete().where(Post.uri.in_(post_uris)).returning(Post.cid, Post.uri).tuples().execute())
+
+    return []
+
+
+def _get_or_create_users(dids):
+    user_ids, missing = _user_ids.get_many(dids)
+    if not missing:
+        return user_ids
+
+    missing.sort()
+    User.insert_many([{'did': did} for did in missing]).on_conflict_ignore().execute()
+    created = dict(User.select(User.did, User.id).where(User.did.in_(missing)).tuples())
+    _user_ids.set_many(created)
+
+    user_ids.update(created)
+    return user_ids
+
+
+def _get_or_create_languages(codes):
+    if not _language_ids:
+        _language_ids.update(Language.select(Language.code, Language.id).tuples())
+
+    missing = sorted(code for code in codes if code not in _language_ids)
+    if missing:
+        Language.insert_many([{'code': code} for code in missing]).on_conflict_ignore().execute()
+        _language_ids.update(Language.select(Language.code, Language.id).where(Language.code.in_(missing)).tuples())
+
+    return _language_ids
+
+
+def _upsert_posts(posts, subjects, user_ids):
+    """Create the posts of a batch, and placeholders for the subjects of its interactions.
+
+    Both go in one statement locking rows in uri order, so concurrent batches can't deadlock on them.
+    """
+    now = datetime.utcnow()
+    rows = {
+        uri: {
+            'author': None,
+            'uri': uri,
+            'cid': cid,
+            'reply_parent': None,
+            'reply_root': None,
+            'created_at': now,
+            'indexed_at': now,
         }
-    )
-    if not created:
-        post.indexed_at = datetime.utcnow()
-        post.save()
-    return post
-
-
-def _process_posts(ops):
-    posts_to_create = []
-    for created_post in ops[models.ids.AppBskyFeedPost]['created']:
-        record = created_post['record']
-
-        reply_parent = None
-        if record.reply and record.reply.parent.uri:
-            reply_parent = record.reply.parent.uri
-
-        reply_root = None
-        if record.reply and record.reply.root.uri:
-            reply_root = record.reply.root.uri
-
-        # Get or create author
-        author = _get_or_create_author(created_post, update_statistics=True)
-
-        # Detect languages
-        languages = record.langs or []
-        languages = detect_language(record.text, languages)
-        languages = {
-            Language.get_or_create(code=lang)[0]
-            for lang in languages
+        for uri, cid in subjects.items()
+    }
+    rows.update({
+        uri: {
+            'author': user_ids[post['author']],
+            'uri': uri,
+            'cid': post['cid'],
+            'reply_parent': post['reply_parent'],
+            'reply_root': post['reply_root'],
+            'created_at': post['created_at'],
+            'indexed_at': now,
         }
+        for uri, post in posts.items()
+    })
+    if not rows:
+        return {}
+
+    # Posts fill in placeholders previously created as subject of an interaction, placeholders only
+    # keep interacted posts alive for the cleaner
+    placeholder = EXCLUDED.author_id.is_null()
+    query = Post.insert_many([rows[uri] for uri in sorted(rows)]).on_conflict(
+        conflict_target=[Post.uri],
+        update={
+            Post.author: fn.COALESCE(EXCLUDED.author_id, Post.author),
+            Post.cid: Case(None, [(placeholder, Post.cid)], EXCLUDED.cid),
+            Post.reply_parent: fn.COALESCE(EXCLUDED.reply_parent, Post.reply_parent),
+            Post.reply_root: fn.COALESCE(EXCLUDED.reply_root, Post.reply_root),
+            Post.created_at: Case(None, [(placeholder, Post.created_at)], EXCLUDED.created_at),
+            Post.indexed_at: EXCLUDED.indexed_at,
+        },
+    ).returning(Post.uri, Post.id)
+    return dict(query.tuples().execute())
+
+
+def _statistics_due(dids):
+    """Authors due a statistics update, with their score in the statistics queue."""
+    # last_update is stored in local time by the statistics worker
+    now = datetime.now()
+
+    updates, missing = _user_updates.get_many(dids)
+    for did, (due_at, _) in list(updates.items()):
+        if due_at <= now:
+            del updates[did]
+            missing.append(did)
+
+    if missing:
+        query = User.select(User.did, User.last_update, User.followers_count).where(User.did.in_(missing))
+        for did, last_update, followers_count in query.tuples():
+            updates[did] = (last_update + statistics.UPDATE_INTERVAL if last_update else now, followers_count)
+            _user_updates.set(did, updates[did])
+
+    queued = {}
+    for did, (due_at, followers_count) in updates.items():
+        if due_at > now:
+            continue
+
+        score = now.timestamp()
+        if followers_count and followers_count >= config.TOP_ACCOUNT_FOLLOWERS:
+            score -= _STATISTICS_PRIORITY.total_seconds()
+        queued[did] = score
+        _user_updates.set(did, (now + _STATISTICS_RETRY, followers_count))
+
+    return queued
+
+
+def _write(posts, interactions):
+    """Write a batch, to be called within a transaction.
+
+    Returns:
+        :obj:`tuple`: Whether the top Spanish timeline changed, and the authors due a statistics update.
+    """
+    post_authors = {post['author'] for post in posts.values()}
+    user_ids = _get_or_create_users(post_authors | {i['author'] for i in interactions.values()})
+    language_ids = _get_or_create_languages({code for post in posts.values() for code in post['languages']})
+
+    post_ids = _upsert_posts(
+        posts,
+        {
+            interaction['subject_uri']: interaction['subject_cid']
+            for interaction in interactions.values()
+            if interaction['subject_uri'] not in posts
+        },
+        user_ids,
+    )
 
-        post_dict = {
-            'author': author,
-            'uri': created_post['uri'],
-            'cid': created_post['cid'],
-            'reply_parent': reply_parent,
-            'reply_root': reply_root,
-            'languages': languages,
-            'created_at': parser.parse(record.created_at),
+    post_languages = [
+        {'post': post_ids[uri], 'language': language_ids[code]}
+        for uri, post in posts.items()
+        for code in post['languages']
+    ]
+    if post_languages:
+        PostLanguage.insert_many(post_languages).on_conflict_ignore().execute()
+
+    milestone_post_ids = []
+    if interactions:
+        # Interactions replayed after a reconnect are skipped, and must not be counted again. The uri
+        # can't be unique in the partitioned table, but commits of a repo are all written by the same
+        # process one batch after another, so nothing else inserts the same uri meanwhile.
+        stored = {
+            uri for uri, in Interaction.select(Interaction.uri).where(Interaction.uri.in_(list(interactions))).tuples()
         }
-        posts_to_create.append(post_dict)
+        interactions = {uri: interaction for uri, interaction in interactions.items() if uri not in stored}
+
+    if interactions:
+        Interaction.insert_many([
+            {
+                'author': user_ids[interaction['author']],
+                'post': post_ids[interaction['subject_uri']],
+                'uri': uri,
+                'cid': interaction['cid'],
+                'interaction_type': interaction['interaction_type'],
+                'created_at': interaction['created_at'],
+            }
+            for uri, interaction in sorted(interactions.items())
+        ]).execute()
+
+        milestone_post_ids = _update_stats(interactions, post_ids)
+
+    spanish_id = _get_or_create_languages({timelines.TOP_SPANISH_LANGUAGE})[timelines.TOP_SPANISH_LANGUAGE]
+    featured = timelines.add_top_spanish(
+        spanish_id,
+        [post_ids[uri] for uri, post in posts.items() if timelines.TOP_SPANISH_LANGUAGE in post['languages']],
+        [uri for uri, interaction in interactions.items() if interaction['interaction_type'] == Interaction.REPOST],
+        milestone_post_ids,
+    )
 
-    posts_to_delete = [p['uri'] for p in ops[models.ids.AppBskyFeedPost]['deleted']]
-    if posts_to_delete:
-        Post.delete().where(Post.uri.in_(posts_to_delete))
+    return featured, _statistics_due(post_authors)
+
+
+def _database_available():
+    try:
+        db.execute_sql('SELECT 1')
+    except Exception:
+        return False
+    return True
+
+
+def _update_stats(interactions, post_ids):
+    stats = {}
+    for uri, interaction in interactions.items():
+        post_stats = stats.setdefault(post_ids[interaction['subject_uri']], {'likes': [], 'reposts': []})
+        if interaction['interaction_type'] == Interaction.LIKE:
+            post_stats['likes'].append(interaction['created_at'])
+        else:
+            post_stats['reposts'].append((interaction['created_at'], uri))
+
+    rows = []
+    for post_id, post_stats in sorted(stats.items()):
+        likes = sorted(post_stats['likes'])
+        last_repost_at, last_repost_uri = max(post_stats['reposts'], default=(None, None))
+        rows.append({
+            'post': post_id,
+            'like_count': len(likes),
+            'repost_count': len(post_stats['reposts']),
+            'last_like_at': likes[-1] if likes else None,
+            'like_milestone_at': likes[config.LIKES_MILESTONE - 1] if len(likes) >= config.LIKES_MILESTONE else None,
+            'last_repost_uri': last_repost_uri,
+            'last_repost_at': last_repost_at,
+        })
+
+    # The milestone of posts crossing it within this batch is set to the batch's last like
+    updated = PostStats.insert_many(rows).on_conflict(
+        conflict_target=[PostStats.post],
+        update={
+            PostStats.like_count: PostStats.like_count + EXCLUDED.like_count,
+            PostStats.repost_count: PostStats.repost_count + EXCLUDED.repost_count,
+            PostStats.last_like_at: fn.COALESCE(EXCLUDED.last_like_at, PostStats.last_like_at),
+            PostStats.like_milestone_at: Case(None, [(
+                PostStats.like_milestone_at.is_null()
+                & (PostStats.like_count + EXCLUDED.like_count >= config.LIKES_MILESTONE),
+                EXCLUDED.last_like_at,
+            )], PostStats.like_milestone_at),
+            PostStats.last_repost_uri: fn.COALESCE(EXCLUDED.last_repost_uri, PostStats.last_repost_uri),
+            PostStats.last_repost_at: fn.COALESCE(EXCLUDED.last_repost_at, PostStats.last_repost_at),
+        },
+    ).returning(PostStats.post, PostStats.like_count, PostStats.like_milestone_at).tuples().execute()
+
+    # Posts which were below the milestone before this batch
+    batch_likes = {row['post']: row['like_count'] for row in rows}
+    return [
+        post_id
+        for post_id, like_count, like_milestone_at in updated
+        if like_milestone_at is not None and like_count - batch_likes[post_id] < config.LIKES_MILESTONE
+    ]
 
-    if posts_to_create:
-        with db.atomic():
-            for post_dict in posts_to_create:
-                languages = post_dict.pop("languages")
-                post = Post.create(**post_dict)
-                post.languages = list(languages)
 
+def _index_feeds(posts, featured, pipeline):
+    feed_posts = [
+        (code, post['created_at'], post['cid'], uri)
+        for uri, post in posts.items()
+        if post['reply_root'] is None
+        for code in post['languages'] & config.LANGUAGE_FEEDS.keys()
+    ]
+    if feed_posts:
+        feed_index.add(feed_posts, pipeline)
+
+    # Head pages of the feeds with new posts are stale now
+    updated_feeds = {config.LANGUAGE_FEEDS[code] for code, _, _, _ in feed_posts}
+    if featured:
+        updated_feeds.add(config.TOP_SPANISH_URI)
+    page_cache.invalidate(updated_feeds, pipeline)
+
+
+def _process_posts(ops, posts):
+    for record in ops[models.ids.AppBskyFeedPost]['created']:
+        posts[record.uri] = {
+            'author': record.author,
+            'cid': record.cid,
+            'reply_parent': record.reply_parent or None,
+            'reply_root': record.reply_root or None,
+            'text': record.text,
+            'langs': record.langs,
+            'created_at': record.created_at,
+        }
+
+    posts_to_delete = ops[models.ids.AppBskyFeedPost]['deleted']
+    for uri in posts_to_delete:
+        # created and deleted within the same batch
+        posts.pop(uri, None)
+    return posts_to_delete
 
-def _process_interactions(ops):
-    interactions_to_create = []
-    for interaction_type, created_interaction in chain(
+
+def _process_interactions(ops, interactions):
+    for interaction_type, record in chain(
             zip(cycle([Interaction.LIKE]), ops[models.ids.AppBskyFeedLike]['created']),
             zip(cycle([Interaction.REPOST]), ops[models.ids.AppBskyFeedRepost]['created'])
     ):
-        record = created_interaction['record']
-
-        # Get author and Post
-        author = _get_or_create_author(created_interaction)
-        post = _get_or_create_post(record.subject.uri, record.subject.cid)
-
-        interaction_dict = {
-            'author': author,
-            'post': post,
-            'uri': created_interaction['uri'],
-            'cid': created_interaction['cid'],
+        interactions[record.uri] = {
+            'author': record.author,
+            'subject_uri': record.subject_uri,
+            'subject_cid': record.subject_cid,
+            'cid': record.cid,
             'interaction_type': interaction_type,
-            'created_at': parser.parse(record.created_at),
+            'created_at': record.created_at,
         }
-        interactions_to_create.append(interaction_dict)
 
-    interactions_to_delete = [
-        p['uri']
-        for p in ops[models.ids.AppBskyFeedLike]['deleted'] + ops[models.ids.AppBskyFeedRepost]['deleted']
-    ]
-    if interactions_to_delete:
-        Interaction.delete().where(Interaction.uri.in_(interactions_to_delete))
+    interactions_to_delete = ops[models.ids.AppBskyFeedLike]['deleted'] + ops[models.ids.AppBskyFeedRepost]['deleted']
+    for uri in interactions_to_delete:
+        # created and deleted within the same batch
+        interactions.pop(uri, None)
+    return interactions_to_delete
+
+
+def _process_follows(ops, created, deleted):
+    for record in ops[models.ids.AppBskyGraphFollow]['created']:
+        created.append((record.author, record.subject))
+
+    for uri in ops[models.ids.AppBskyGraphFollow]['deleted']:
+        # at://<follower did>/app.bsky.graph.follow/<record key>
+        deleted.append(uri[len('at://'):].split('/', 1)[0])
+
 
-    if interactions_to_create:
-        with db.atomic():
-            for interaction_dict in interactions_to_create:
-                Interaction.create(**interaction_dict)
+operations_callback = Indexer()
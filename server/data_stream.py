@@ -1,89 +1,311 @@
-from collections import defaultdict
+import multiprocessing
+import queue
+import signal
+import time
+import zlib
+from collections import Counter, defaultdict, deque
 
-from atproto import AtUri, CAR, firehose_models, FirehoseSubscribeReposClient, models, parse_subscribe_repos_message
+from atproto import CAR, firehose_models, FirehoseSubscribeReposClient, models, parse_subscribe_repos_message
 
+from server import metrics, records
+from server.checkpoint import Checkpointer
 from server.database import SubscriptionState
 from server.logger import logger
 
-_INTERESTED_RECORDS = {
-    models.AppBskyFeedLike: models.ids.AppBskyFeedLike,
-    models.AppBskyFeedPost: models.ids.AppBskyFeedPost,
-    models.AppBskyFeedRepost: models.ids.AppBskyFeedRepost,
-}
+_WORKER_QUEUE_SIZE = 1000
+_WORKER_REPORT_SIZE = 100
+_WORKER_REPORT_TIMEOUT = 1
+# Seconds a full worker queue is waited on before checking the worker is still alive
+_WORKER_PUT_TIMEOUT = 1
+
+_CAR_DECODE_SECONDS = metrics.INGEST_STAGE_SECONDS.labels('car_decode')
+_RECORD_DECODE_SECONDS = metrics.INGEST_STAGE_SECONDS.labels('record_decode')
+_COMMIT_PARSE_SECONDS = metrics.INGEST_STAGE_SECONDS.labels('commit_parse')
+
+
+def _collection(path: str) -> str:
+    # repo paths are "<collection>/<record key>"
+    return path.split('/', 1)[0]
+
+
+def _has_interesting_ops(ops) -> bool:
+    """Whether the raw ops of a commit frame create or delete records we index, before parsing it."""
+    return any(op['action'] != 'update' and _collection(op['path']) in records.COLLECTIONS for op in ops)
 
 
 def _get_ops_by_type(commit: models.ComAtprotoSyncSubscribeRepos.Commit) -> defaultdict:
+    """Group the creates and deletes of a commit by collection.
+
+    Creates are :obj:`server.records` records, deletes are URIs.
+    """
     operation_by_type = defaultdict(lambda: {'created': [], 'deleted': []})
 
-    car = CAR.from_bytes(commit.blocks)
+    # blocks are only decoded once a create we are interested in shows up
+    car = None
+    decode_seconds = 0
     for op in commit.ops:
         if op.action == 'update':
             # we are not interested in updates
             continue
 
-        uri = AtUri.from_str(f'at://{commit.repo}/{op.path}')
+        collection = _collection(op.path)
+        if collection not in records.COLLECTIONS:
+            continue
+
+        uri = f'at://{commit.repo}/{op.path}'
 
         if op.action == 'create':
             if not op.cid:
                 continue
 
-            create_info = {'uri': str(uri), 'cid': str(op.cid), 'author': commit.repo}
+            if car is None:
+                with metrics.timed(_CAR_DECODE_SECONDS):
+                    car = CAR.from_bytes(commit.blocks)
 
             record_raw_data = car.blocks.get(op.cid)
             if not record_raw_data:
                 continue
 
-            record = models.get_or_create(record_raw_data, strict=False)
-            for record_type, record_nsid in _INTERESTED_RECORDS.items():
-                if uri.collection == record_nsid and models.is_record_type(record, record_type):
-                    operation_by_type[record_nsid]['created'].append({'record': record, **create_info})
-                    break
+            decode_started_at = time.perf_counter()
+            record = records.from_raw(collection, uri, str(op.cid), commit.repo, record_raw_data)
+            decode_seconds += time.perf_counter() - decode_started_at
+            if record is not None:
+                operation_by_type[collection]['created'].append(record)
 
         if op.action == 'delete':
-            operation_by_type[uri.collection]['deleted'].append({'uri': str(uri)})
+            operation_by_type[collection]['deleted'].append(uri)
 
+    if car is not None:
+        _RECORD_DECODE_SECONDS.observe(decode_seconds)
     return operation_by_type
 
 
-def run(name, operations_callback, stream_stop_event=None):
-    while stream_stop_event is None or not stream_stop_event.is_set():
+def _parse(message):
+    with metrics.timed(_COMMIT_PARSE_SECONDS):
+        return parse_subscribe_repos_message(message)
+
+
+def _worker(commits_queue, done_queue, operations_callback):
+    # the reader owns shutdown, workers only stop on the sentinel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    finished = []
+    while True:
         try:
-            _run(name, operations_callback, stream_stop_event)
-        except:
-            continue
+            item = commits_queue.get(timeout=_WORKER_REPORT_TIMEOUT)
+        except queue.Empty:
+            item = False
+
+        if item:
+            seq, message = item
+            try:
+                commit = _parse(message)
+                finished.extend(operations_callback(_get_ops_by_type(commit), seq))
+            except Exception:
+                logger.exception(f'Error processing commit {seq}')
+                finished.append(seq)
+        else:
+            # write whatever is pending while the queue is idle or closing
+            finished.extend(operations_callback.flush())
+
+        if finished and (not item or len(finished) >= _WORKER_REPORT_SIZE):
+            done_queue.put(finished)
+            finished = []
+
+        if item is None:
+            break
+
+
+class Watermark:
+    """Highest sequence number such that every commit up to it has been finished.
+
+    A sequence number replayed after a reconnect is in flight once per time it was added, and
+    has to be finished as many times.
+    """
+
+    def __init__(self):
+        self._in_flight = deque()
+        self._finished = Counter()
+        self.value = None
+
+    def add(self, seq):
+        self._in_flight.append(seq)
+
+    def finish(self, seqs):
+        self._finished.update(seqs)
+
+        while self._in_flight and self._finished[self._in_flight[0]]:
+            self.value = self._in_flight.popleft()
+            self._finished[self.value] -= 1
+            if not self._finished[self.value]:
+                del self._finished[self.value]
+
+        return self.value
+
+
+class WorkerExited(RuntimeError):
+    """A firehose worker process died, the commits it held will never be reported."""
+
+
+class ShardedDispatcher:
+    """Hands commit frames over to worker processes, sharded by repo DID.
 
+    Frames of a repo always land on the same worker and every worker consumes its queue in order,
+    so per-repo ordering holds. Workers report back the sequence numbers whose rows they have
+    written, and the watermark only moves over a contiguous prefix of those, so a cursor taken
+    from it never skips an event that is still in flight.
 
-def _run(name, operations_callback, stream_stop_event=None):
+    A worker dying would hold the watermark back forever, so :obj:`WorkerExited` is raised as
+    soon as one is found dead, for the consumer to restart from the stored cursor.
+    """
+
+    def __init__(self, operations_callback, workers, watermark):
+        context = multiprocessing.get_context('spawn')
+
+        self._done_queue = context.Queue()
+        self._commit_queues = [context.Queue(maxsize=_WORKER_QUEUE_SIZE) for _ in range(workers)]
+        self._processes = [
+            context.Process(
+                target=_worker,
+                args=(commits_queue, self._done_queue, operations_callback),
+                daemon=True,
+            )
+            for commits_queue in self._commit_queues
+        ]
+        self._watermark = watermark
+
+    def start(self):
+        for process in self._processes:
+            process.start()
+
+    def dispatch(self, seq, repo, message):
+        shard = zlib.crc32(repo.encode()) % len(self._commit_queues)
+        while True:
+            try:
+                self._commit_queues[shard].put((seq, message), timeout=_WORKER_PUT_TIMEOUT)
+                return
+            except queue.Full:
+                # the queue of a dead worker never drains
+                self._check(self._processes[shard])
+
+    def collect(self):
+        self._drain()
+        for process in self._processes:
+            self._check(process)
+
+        metrics.QUEUE_DEPTH.labels('firehose_workers').set(sum(q.qsize() for q in self._commit_queues))
+
+    def stop(self):
+        for commits_queue, process in zip(self._commit_queues, self._processes):
+            if process.is_alive():
+                commits_queue.put(None)
+
+        # drain reports while waiting, a worker can't exit with unflushed queue data
+        while any(process.is_alive() for process in self._processes):
+            self._drain()
+            for process in self._processes:
+                process.join(timeout=0.1)
+        self._drain()
+
+    def _drain(self):
+        while True:
+            try:
+                self._watermark.finish(self._done_queue.get_nowait())
+            except queue.Empty:
+                break
+
+    @staticmethod
+    def _check(process):
+        if process.exitcode is not None:
+            raise WorkerExited(f'Firehose worker {process.pid} exited with code {process.exitcode}')
+
+
+def run(name, operations_callback, stream_stop_event=None, workers=1):
+    """Consume the firehose until ``stream_stop_event`` is set.
+
+    ``operations_callback`` is called with the operations and the sequence number of every commit,
+    and returns the sequence numbers whose rows have been written by then. Its ``flush()`` method
+    writes everything pending and returns the same.
+    """
     state = SubscriptionState.get_or_none(SubscriptionState.service == name)
+    if not state:
+        state = SubscriptionState.create(service=name, cursor=0)
 
+    checkpointer = Checkpointer(name, state.cursor)
+    watermark = Watermark()
+
+    dispatcher = None
+    if workers > 1:
+        dispatcher = ShardedDispatcher(operations_callback, workers, watermark)
+        dispatcher.start()
+
+    try:
+        while stream_stop_event is None or not stream_stop_event.is_set():
+            try:
+                _run(operations_callback, stream_stop_event, checkpointer, watermark, dispatcher)
+            except WorkerExited:
+                logger.exception('Stopping firehose consumer')
+                raise
+            except:
+                continue
+    finally:
+        if dispatcher:
+            dispatcher.stop()
+        else:
+            watermark.finish(operations_callback.flush())
+
+        if watermark.value is not None and watermark.value > checkpointer.cursor:
+            checkpointer.commit(watermark.value)
+
+
+def _run(operations_callback, stream_stop_event, checkpointer, watermark, dispatcher=None):
     params = None
-    if state:
-        params = models.ComAtprotoSyncSubscribeRepos.Params(cursor=state.cursor)
+    if checkpointer.cursor:
+        params = models.ComAtprotoSyncSubscribeRepos.Params(cursor=checkpointer.cursor)
 
     client = FirehoseSubscribeReposClient(params)
 
-    if not state:
-        SubscriptionState.create(service=name, cursor=0)
-
     def on_message_handler(message: firehose_models.MessageFrame) -> None:
         # stop on next message if requested
         if stream_stop_event and stream_stop_event.is_set():
             client.stop()
             return
 
-        commit = parse_subscribe_repos_message(message)
-        if not isinstance(commit, models.ComAtprotoSyncSubscribeRepos.Commit):
+        # only peek at the frame here, parsing and decoding may happen in the workers
+        if message.type != '#commit':
             return
 
-        # update stored state every ~20 events
-        if commit.seq % 20 == 0:
-            logger.info(f'Updated cursor for {name} to {commit.seq}')
-            client.update_params(models.ComAtprotoSyncSubscribeRepos.Params(cursor=commit.seq))
-            SubscriptionState.update(cursor=commit.seq).where(SubscriptionState.service == name).execute()
+        seq = message.body['seq']
+        metrics.FIREHOSE_FRAMES.inc()
+        watermark.add(seq)
+        checkpointer.observe(seq, message.body['time'])
 
-        if not commit.blocks:
-            return
+        if not message.body.get('blocks') or not _has_interesting_ops(message.body['ops']):
+            watermark.finish([seq])
+        elif dispatcher:
+            dispatcher.dispatch(seq, message.body['repo'], message)
+        else:
+            try:
+                commit = _parse(message)
+                watermark.finish(operations_callback(_get_ops_by_type(commit), seq))
+            except Exception:
+                logger.exception(f'Error processing commit {seq}')
+                watermark.finish([seq])
+
+        if dispatcher:
+            dispatcher.collect()
 
-        operations_callback(_get_ops_by_type(commit))
+        if checkpointer.advance(watermark.value):
+            client.update_params(models.ComAtprotoSyncSubscribeRepos.Params(cursor=checkpointer.cursor))
+
+    # the client swallows errors raised by the handler, a dead worker has to end the stream
+    failures = []
+
+    def on_callback_error_handler(error: BaseException) -> None:
+        if isinstance(error, WorkerExited):
+            failures.append(error)
+            client.stop()
 
-    client.start(on_message_handler)
+    client.start(on_message_handler, on_callback_error_handler)
+    if failures:
+        raise failures[0]
@@ -1,13 +1,32 @@
+import time
 from datetime import datetime
 
 import peewee
+from playhouse.pool import PooledPostgresqlDatabase
 
-db = peewee.PostgresqlDatabase(
+from server import config, metrics
+
+
+class InstrumentedDatabase(PooledPostgresqlDatabase):
+    """Reports the latency of every query to :obj:`server.metrics.DB_QUERY_SECONDS`."""
+
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute_sql(sql, params, *args, **kwargs)
+        finally:
+            metrics.DB_QUERY_SECONDS.labels(metrics.statement(sql)).observe(time.perf_counter() - start)
+
+
+# Connections are per thread, and go back to the pool when closed
+db = InstrumentedDatabase(
     "bsky_feeds",
     user="postgres",
     password="postgres",
     host="db",
-    port=5432
+    port=5432,
+    max_connections=config.DB_MAX_CONNECTIONS,
+    stale_timeout=300,
 )
 
 
@@ -48,9 +67,18 @@ PostLanguage = Post.languages.get_through_model()
 
 
 class Interaction(BaseModel):
+    """Likes and reposts, partitioned by day of ``indexed_at``, see :obj:`server.partitions`.
+
+    Unique keys of partitioned tables must hold the partition key, so ``uri`` can't be unique.
+    The indexer skips the uris already stored instead, see :obj:`server.data_filter`. This only keeps
+    them unique as long as every repo is handled by a single worker process, of a single ingest
+    deployment: writers racing on the same uri would both insert it and count it twice in
+    :obj:`PostStats`.
+    """
+
     LIKE, REPOST = range(2)
 
-    uri = peewee.CharField(unique=True)
+    uri = peewee.CharField(index=True)
     cid = peewee.CharField()
 
     author = peewee.ForeignKeyField(User, related_name='likes', on_delete="CASCADE")
@@ -64,7 +92,51 @@ class Interaction(BaseModel):
     )
 
     indexed_at = peewee.DateTimeField(default=datetime.utcnow)
-    created_at = peewee.DateTimeField(null=True, index=True)
+    created_at = peewee.DateTimeField(index=True)
+
+    class Meta:
+        indexes = (
+            # Likes by the follows of a user
+            (('author', 'interaction_type', 'created_at'), False),
+        )
+
+
+class PostStats(BaseModel):
+    post = peewee.ForeignKeyField(Post, primary_key=True, backref='stats', on_delete="CASCADE")
+
+    like_count = peewee.IntegerField(default=0)
+    repost_count = peewee.IntegerField(default=0)
+
+    last_like_at = peewee.DateTimeField(null=True)
+    # When the post reached config.LIKES_MILESTONE likes
+    like_milestone_at = peewee.DateTimeField(null=True, index=True)
+
+    last_repost_uri = peewee.CharField(null=True)
+    last_repost_at = peewee.DateTimeField(null=True)
+
+
+class TimelineEntry(BaseModel):
+    TOP_SPANISH, = range(1)
+
+    timeline = peewee.IntegerField(
+        choices=[
+            (TOP_SPANISH, 'top_spanish'),
+        ],
+    )
+    post = peewee.ForeignKeyField(Post, backref='timeline_entries', on_delete="CASCADE")
+
+    uri = peewee.CharField()
+    cid = peewee.CharField()
+    repost_uri = peewee.CharField(null=True)
+
+    # Time of the reason the post is featured for: creation, repost or likes milestone
+    created_at = peewee.DateTimeField()
+
+    class Meta:
+        indexes = (
+            (('timeline', 'post'), True),
+            (('timeline', 'created_at', 'cid'), False),
+        )
 
 
 class SubscriptionState(BaseModel):
@@ -72,6 +144,22 @@ class SubscriptionState(BaseModel):
     cursor = peewee.IntegerField()
 
 
+# peewee can't declare partitioned tables, indexes are still created from the model
+INTERACTION_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS "interaction" (
+        "id" SERIAL NOT NULL,
+        "uri" VARCHAR(255) NOT NULL,
+        "cid" VARCHAR(255) NOT NULL,
+        "author_id" INTEGER NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE,
+        "post_id" INTEGER NOT NULL REFERENCES "post" ("id") ON DELETE CASCADE,
+        "interaction_type" INTEGER NOT NULL,
+        "indexed_at" TIMESTAMP NOT NULL,
+        "created_at" TIMESTAMP NOT NULL,
+        PRIMARY KEY ("id", "indexed_at")
+    ) PARTITION BY RANGE ("indexed_at")
+"""
+INTERACTION_DEFAULT_PARTITION_SQL = 'CREATE TABLE IF NOT EXISTS "interaction_default" PARTITION OF "interaction" DEFAULT'
+
 if db.is_closed():
     db.connect()
     db.create_tables([
@@ -79,6 +167,11 @@ if db.is_closed():
         Language,
         Post,
         PostLanguage,
-        Interaction,
+        PostStats,
+        TimelineEntry,
         SubscriptionState,
     ])
+    if not Interaction.table_exists():
+        db.execute_sql(INTERACTION_TABLE_SQL)
+        db.execute_sql(INTERACTION_DEFAULT_PARTITION_SQL)
+        Interaction._schema.create_indexes()
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+
+from atproto_identity.cache.base_cache import AsyncDidBaseCache, DidBaseCache
+from atproto_identity.cache.models import CachedDid, CachedDidResult
+
+from server.cache import LRUCache
+from server.logger import logger
+
+
+class BoundedDidCache(DidBaseCache):
+    """DID document cache holding up to ``max_size`` documents, refreshing stale ones in the background.
+
+    Documents older than ``stale_ttl`` are still served while a background thread resolves them
+    again, only those older than ``max_ttl`` are resolved within the request.
+    ``resolver`` must be set to the DID resolver using the cache.
+    """
+
+    def __init__(self, max_size, stale_ttl=None, max_ttl=None):
+        super().__init__(stale_ttl, max_ttl)
+        self.resolver = None
+
+        self._documents = LRUCache(max_size, 'did_documents')
+        self._lock = threading.Lock()
+        self._refreshing = set()
+
+    @property
+    def hit_rate(self):
+        return self._documents.hit_rate
+
+    def _get(self, did):
+        with self._lock:
+            cached = self._documents.get(did)
+        if cached is None:
+            return None, False
+
+        age = time.time() - cached.updated_at.timestamp()
+        if age > self.max_ttl:
+            return None, False
+
+        return CachedDidResult(did, cached.document, cached.updated_at, False, False), age > self.stale_ttl
+
+    def _start_refresh(self, did):
+        with self._lock:
+            if did in self._refreshing:
+                return False
+            self._refreshing.add(did)
+            return True
+
+    def _finish_refresh(self, did):
+        with self._lock:
+            self._refreshing.discard(did)
+
+    def _refresh_in_background(self, did):
+        try:
+            self.resolver.refresh_cache(did)
+        except Exception:
+            logger.exception(f'Error refreshing DID document of {did}')
+        finally:
+            self._finish_refresh(did)
+
+    def get(self, did):
+        result, stale = self._get(did)
+        if stale and self.resolver and self._start_refresh(did):
+            threading.Thread(target=self._refresh_in_background, args=(did,), daemon=True).start()
+        return result
+
+    def set(self, did, document):
+        with self._lock:
+            self._documents.set(did, CachedDid(document, datetime.now(timezone.utc)))
+
+    def refresh(self, did, get_doc_callback):
+        document = get_doc_callback()
+        if document:
+            self.set(did, document)
+
+    def delete(self, did):
+        with self._lock:
+            self._documents.delete(did)
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+
+
+class AsyncBoundedDidCache(AsyncDidBaseCache):
+    """Same as :obj:`BoundedDidCache`, for async resolvers. Stale documents are refreshed in a task."""
+
+    def __init__(self, max_size, stale_ttl=None, max_ttl=None):
+        super().__init__(stale_ttl, max_ttl)
+        self.resolver = None
+
+        self._cache = BoundedDidCache(max_size, stale_ttl, max_ttl)
+        self._tasks = set()
+
+    @property
+    def hit_rate(self):
+        return self._cache.hit_rate
+
+    async def _refresh_in_background(self, did):
+        try:
+            await self.resolver.refresh_cache(did)
+        except Exception:
+            logger.exception(f'Error refreshing DID document of {did}')
+        finally:
+            self._cache._finish_refresh(did)
+
+    async def get(self, did):
+        result, stale = self._cache._get(did)
+        if stale and self.resolver and self._cache._start_refresh(did):
+            task = asyncio.ensure_future(self._refresh_in_background(did))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return result
+
+    async def set(self, did, document):
+        self._cache.set(did, document)
+
+    async def refresh(self, did, get_doc_callback):
+        document = await get_doc_callback()
+        if document:
+            self._cache.set(did, document)
+
+    async def delete(self, did):
+        self._cache.delete(did)
+
+    async def clear(self):
+        self._cache.clear()
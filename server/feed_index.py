@@ -0,0 +1,191 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+
+from server import config
+from server.database import db, Post, Language
+from server.logger import logger
+
+redis = Redis(host="redis")
+async_redis = AsyncRedis(host="redis")
+
+_KEY = "bsky-feed-language:{}"
+_READY_KEY = "bsky-feed-language:{}:ready"
+_BACKFILL_LOCK_KEY = "bsky-feed-language:{}:backfill"
+_BACKFILL_LOCK_TIMEOUT = 600
+# Seconds before this process starts another backfill of a language whose index isn't ready yet
+_BACKFILL_RETRY_INTERVAL = 60
+
+# Language code -> when this process last started a backfill thread for it
+_backfills_started = {}
+_backfills_lock = threading.Lock()
+
+
+def _score(created_at: datetime) -> int:
+    # Naive datetimes are read back from Postgres, which stores them in UTC
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return int(created_at.timestamp() * 1000)
+
+
+def _member(cid: str, uri: str) -> str:
+    # Posts sharing a score are ordered by member, so the cid leads to act as tiebreaker
+    return f"{cid} {uri}"
+
+
+def add(posts, pipeline=None) -> None:
+    """Add root posts to the language feed index.
+
+    Args:
+        posts: Tuples of language code, creation time, cid and uri.
+        pipeline: Redis pipeline to queue the commands on, they are sent right away if missing.
+    """
+    pipe = pipeline if pipeline is not None else redis.pipeline(transaction=False)
+
+    by_language = {}
+    for language_code, created_at, cid, uri in posts:
+        by_language.setdefault(language_code, {})[_member(cid, uri)] = _score(created_at)
+
+    oldest = _score(datetime.now(timezone.utc) - timedelta(days=config.RETENTION_DAYS))
+    for language_code, members in by_language.items():
+        key = _KEY.format(language_code)
+        pipe.zadd(key, members)
+        pipe.zremrangebyscore(key, "-inf", f"({oldest}")
+        pipe.zremrangebyrank(key, 0, -(config.LANGUAGE_FEED_SIZE + 1))
+
+    if pipeline is None:
+        pipe.execute()
+
+
+def remove(posts, pipeline=None) -> None:
+    """Remove posts from every language feed index.
+
+    Args:
+        posts: Tuples of cid and uri.
+        pipeline: Redis pipeline to queue the commands on, they are sent right away if missing.
+    """
+    members = [_member(cid, uri) for cid, uri in posts]
+    if not members:
+        return
+
+    pipe = pipeline if pipeline is not None else redis.pipeline(transaction=False)
+    for language_code in config.LANGUAGE_FEEDS:
+        pipe.zrem(_KEY.format(language_code), *members)
+
+    if pipeline is None:
+        pipe.execute()
+
+
+@db.connection_context()
+def backfill(language_code: str) -> None:
+    """Load the latest root posts of a language from Postgres into its feed index."""
+    if not redis.set(_BACKFILL_LOCK_KEY.format(language_code), 1, nx=True, ex=_BACKFILL_LOCK_TIMEOUT):
+        return
+
+    try:
+        language = Language.get_or_none(Language.code == language_code)
+        if language:
+            posts = language.posts.select(
+                Post.uri,
+                Post.cid,
+                Post.created_at,
+            ).where(
+                Post.reply_root.is_null(True),
+                Post.created_at.is_null(False),
+            ).order_by(
+                Post.created_at.desc(),
+                Post.cid.desc(),
+            ).limit(config.LANGUAGE_FEED_SIZE)
+
+            entries = [(language_code, post.created_at, post.cid, post.uri) for post in posts]
+            for i in range(0, len(entries), 1000):
+                add(entries[i:i + 1000])
+
+        redis.set(_READY_KEY.format(language_code), 1)
+        logger.info(f"Backfilled feed index for language {language_code}")
+    except Exception:
+        logger.exception(f"Error backfilling feed index for language {language_code}")
+    finally:
+        redis.delete(_BACKFILL_LOCK_KEY.format(language_code))
+
+
+def _start_backfill(language_code: str) -> None:
+    # Other processes are kept out by the Redis lock, other requests of this one by the last start time,
+    # so a backfill that keeps failing is retried at most every _BACKFILL_RETRY_INTERVAL
+    now = time.monotonic()
+    with _backfills_lock:
+        started_at = _backfills_started.get(language_code)
+        if started_at is not None and now - started_at < _BACKFILL_RETRY_INTERVAL:
+            return
+        _backfills_started[language_code] = now
+
+    threading.Thread(target=backfill, args=(language_code,), daemon=True).start()
+
+
+def _page_posts(entries, cid, max_score, size, limit):
+    posts = []
+    for member, score in entries:
+        member_cid, uri = member.decode().split(" ", 1)
+        if cid is not None and score == max_score and member_cid >= cid:
+            continue
+        posts.append((int(score), member_cid, uri))
+    posts = posts[:limit]
+
+    # The index was trimmed, older posts only live in Postgres
+    if len(posts) < limit and size >= config.LANGUAGE_FEED_SIZE:
+        return None
+
+    return posts
+
+
+def page(language_code: str, created_at: Optional[int], cid: Optional[str], limit: int) -> Optional[list]:
+    """Read a feed page straight from the language feed index.
+
+    Args:
+        language_code: Language of the feed.
+        created_at: Cursor creation time in milliseconds, if any.
+        cid: Cursor cid, if any.
+        limit: Page size.
+
+    Returns:
+        :obj:`list`: Tuples of score, cid and uri of the page posts, or ``None`` if the index can't
+        answer and Postgres should.
+    """
+    key = _KEY.format(language_code)
+    max_score = created_at if created_at is not None else _score(datetime.now(timezone.utc))
+
+    pipe = redis.pipeline(transaction=False)
+    pipe.exists(_READY_KEY.format(language_code))
+    pipe.zcard(key)
+    pipe.zcount(key, max_score, max_score)
+    ready, size, ties = pipe.execute()
+
+    if not ready:
+        _start_backfill(language_code)
+        return None
+
+    entries = redis.zrevrangebyscore(key, max_score, "-inf", start=0, num=limit + ties, withscores=True)
+    return _page_posts(entries, cid, max_score, size, limit)
+
+
+async def page_async(language_code: str, created_at: Optional[int], cid: Optional[str], limit: int) -> Optional[list]:
+    """Same as :obj:`page`, on the async Redis client."""
+    key = _KEY.format(language_code)
+    max_score = created_at if created_at is not None else _score(datetime.now(timezone.utc))
+
+    pipe = async_redis.pipeline(transaction=False)
+    pipe.exists(_READY_KEY.format(language_code))
+    pipe.zcard(key)
+    pipe.zcount(key, max_score, max_score)
+    ready, size, ties = await pipe.execute()
+
+    if not ready:
+        _start_backfill(language_code)
+        return None
+
+    entries = await async_redis.zrevrangebyscore(key, max_score, "-inf", start=0, num=limit + ties, withscores=True)
+    return _page_posts(entries, cid, max_score, size, limit)
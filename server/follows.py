@@ -0,0 +1,162 @@
+import asyncio
+import threading
+
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+
+from server import config, metrics
+from server.logger import logger
+
+redis = Redis(host="redis")
+async_redis = AsyncRedis(host="redis")
+
+_KEY = "bsky-follows:{}"
+_FRESH_KEY = "bsky-follows:{}:fresh"
+# Member of every cached set, so users following nobody are cached too
+_SENTINEL = b""
+
+_HITS = metrics.CACHE_LOOKUPS.labels('follows', 'hit')
+_MISSES = metrics.CACHE_LOOKUPS.labels('follows', 'miss')
+
+# Background refreshes of the async path, referenced until they are done
+_refreshing = set()
+
+# Only follows of users already cached are kept, the rest are fetched on their first request
+_ADD_IF_CACHED = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('SADD', KEYS[1], unpack(ARGV))
+end
+return 0
+"""
+
+# Script -> SHA1, loaded once per process. Script objects would check the scripts exist before every
+# pipeline execution, the pipelines queue EVALSHA instead.
+_script_shas = {}
+
+
+def _script_sha(script: str) -> str:
+    if script not in _script_shas:
+        _script_shas[script] = redis.script_load(script)
+    return _script_shas[script]
+
+
+def forget_scripts() -> None:
+    """Load the scripts again on their next use, after Redis lost them on a restart (``NoScriptError``)."""
+    _script_shas.clear()
+
+
+def _follows_dids(members) -> list:
+    return [member.decode() for member in members if member != _SENTINEL]
+
+
+def _store(did: str, follows_dids) -> None:
+    key = _KEY.format(did)
+    pipe = redis.pipeline()
+    pipe.delete(key)
+    pipe.sadd(key, _SENTINEL, *follows_dids)
+    pipe.expire(key, config.FOLLOWS_CACHE_TTL)
+    pipe.execute()
+
+
+def _refresh(did: str, fetch) -> None:
+    try:
+        _store(did, fetch(did))
+    except Exception:
+        logger.exception(f"Error refreshing follows of {did}")
+        redis.delete(_FRESH_KEY.format(did))
+
+
+def get(did: str, fetch) -> list:
+    """Get the DIDs followed by a user, from the follow graph cache if possible.
+
+    Cached follows are served for up to ``config.FOLLOWS_CACHE_TTL`` seconds, and refreshed in the
+    background once they are older than ``config.FOLLOWS_REFRESH_INTERVAL``.
+
+    Args:
+        did: User DID.
+        fetch: Function fetching the DIDs followed by a user from the network.
+
+    Returns:
+        :obj:`list`: Followed DIDs.
+    """
+    members = redis.smembers(_KEY.format(did))
+
+    # Also works as a lock, so that a single refresh runs at a time
+    stale = redis.set(_FRESH_KEY.format(did), 1, nx=True, ex=config.FOLLOWS_REFRESH_INTERVAL)
+
+    if not members:
+        _MISSES.inc()
+        follows_dids = fetch(did)
+        _store(did, follows_dids)
+        return follows_dids
+
+    _HITS.inc()
+    follows_dids = _follows_dids(members)
+    if stale:
+        threading.Thread(target=_refresh, args=(did, fetch), daemon=True).start()
+
+    return follows_dids
+
+
+async def _store_async(did: str, follows_dids) -> None:
+    key = _KEY.format(did)
+    pipe = async_redis.pipeline()
+    pipe.delete(key)
+    pipe.sadd(key, _SENTINEL, *follows_dids)
+    pipe.expire(key, config.FOLLOWS_CACHE_TTL)
+    await pipe.execute()
+
+
+async def _refresh_async(did: str, fetch) -> None:
+    try:
+        await _store_async(did, await fetch(did))
+    except Exception:
+        logger.exception(f"Error refreshing follows of {did}")
+        await async_redis.delete(_FRESH_KEY.format(did))
+
+
+async def get_async(did: str, fetch) -> list:
+    """Same as :obj:`get`, on the async Redis client and with ``fetch`` returning a coroutine."""
+    members = await async_redis.smembers(_KEY.format(did))
+    stale = await async_redis.set(_FRESH_KEY.format(did), 1, nx=True, ex=config.FOLLOWS_REFRESH_INTERVAL)
+
+    if not members:
+        _MISSES.inc()
+        follows_dids = await fetch(did)
+        await _store_async(did, follows_dids)
+        return follows_dids
+
+    _HITS.inc()
+    follows_dids = _follows_dids(members)
+    if stale:
+        task = asyncio.ensure_future(_refresh_async(did, fetch))
+        _refreshing.add(task)
+        task.add_done_callback(_refreshing.discard)
+
+    return follows_dids
+
+
+def update(created, deleted, pipeline=None) -> None:
+    """Apply follow records from the firehose to the cached follows.
+
+    Args:
+        created: Tuples of follower and followed DIDs.
+        deleted: DIDs of users who unfollowed someone.
+        pipeline: Redis pipeline to queue the commands on, they are sent right away if missing.
+    """
+    pipe = pipeline if pipeline is not None else redis.pipeline(transaction=False)
+
+    subjects = {}
+    for follower, subject in created:
+        subjects.setdefault(follower, []).append(subject)
+    if subjects:
+        sha = _script_sha(_ADD_IF_CACHED)
+        for follower, follower_subjects in sorted(subjects.items()):
+            pipe.evalsha(sha, 1, _KEY.format(follower), *follower_subjects)
+
+    # Deleted records don't tell who was unfollowed, refresh on the next request instead
+    if deleted:
+        pipe.delete(*[_FRESH_KEY.format(follower) for follower in set(deleted)])
+
+    if pipeline is None:
+        pipe.execute()
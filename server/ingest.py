@@ -0,0 +1,32 @@
+"""Firehose consumer, indexing posts and interactions.
+
+Run with ``python -m server.ingest``, a single instance at a time.
+"""
+import signal
+import threading
+
+from server import config, data_stream, metrics, partitions
+from server.data_filter import operations_callback
+from server.logger import logger
+
+
+def main():
+    stop_event = threading.Event()
+
+    def stop_handler(*_):
+        logger.info('Stopping firehose consumer...')
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, stop_handler)
+    signal.signal(signal.SIGTERM, stop_handler)
+
+    metrics.serve()
+
+    # Today's interactions must not land in the default partition if the cleaner isn't up yet
+    partitions.create(config.PARTITION_DAYS_AHEAD)
+
+    data_stream.run(config.SERVICE_DID, operations_callback, stop_event, config.FIREHOSE_WORKERS)
+
+
+if __name__ == '__main__':
+    main()
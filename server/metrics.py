@@ -0,0 +1,95 @@
+"""Prometheus metrics.
+
+Web servers expose them at ``/metrics``, ingestion and background workers on ``METRICS_PORT``
+through :obj:`serve`. Services running several processes, gunicorn or firehose workers, need
+``PROMETHEUS_MULTIPROC_DIR`` set to an empty directory for their metrics to be aggregated.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+from server import config
+
+_MULTIPROCESS = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+# Ingestion stages and queries mostly take well under the default 5ms first bucket
+_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+FIREHOSE_FRAMES = Counter('firehose_frames', 'Commit frames received from the firehose')
+FIREHOSE_LAG = Gauge(
+    'firehose_lag_seconds',
+    'Time between the emission of the last written firehose event and now',
+    multiprocess_mode='max',
+)
+INGEST_STAGE_SECONDS = Histogram(
+    'ingest_stage_seconds',
+    'Time spent on each ingestion stage, per commit or per flushed batch',
+    ['stage'],
+    buckets=_BUCKETS,
+)
+QUEUE_DEPTH = Gauge('queue_depth', 'Items waiting in a queue', ['queue'], multiprocess_mode='livesum')
+CACHE_LOOKUPS = Counter('cache_lookups', 'Cache lookups by cache and result', ['cache', 'result'])
+HTTP_REQUEST_SECONDS = Histogram('http_request_seconds', 'HTTP request latency', ['endpoint', 'status'])
+FEED_REQUEST_SECONDS = Histogram('feed_request_seconds', 'Feed skeleton latency by feed', ['feed'])
+DB_QUERY_SECONDS = Histogram(
+    'db_query_seconds',
+    'Database query latency by statement type',
+    ['statement'],
+    buckets=_BUCKETS,
+)
+
+
+@contextmanager
+def timed(histogram):
+    """Observe the time spent in the block on ``histogram``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+def statement(sql: str) -> str:
+    """Statement type of a query, such as ``SELECT`` or ``INSERT``."""
+    return sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+
+
+def _registry():
+    if not _MULTIPROCESS:
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render():
+    """Render the metrics of the service.
+
+    Returns:
+        :obj:`tuple`: Body and content type of the response.
+    """
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+
+def serve(port=config.METRICS_PORT) -> None:
+    """Expose the metrics of the service on ``port`` from a background thread."""
+    start_http_server(port, registry=_registry())
+
+
+def mark_process_dead(pid) -> None:
+    """Drop the live gauges of a worker process that exited."""
+    if _MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
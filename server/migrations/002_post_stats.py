@@ -0,0 +1,52 @@
+"""Peewee migrations -- 002_post_stats.py."""
+
+from contextlib import suppress
+
+import peewee as pw
+from peewee_migrate import Migrator
+
+
+with suppress(ImportError):
+    import playhouse.postgres_ext as pw_pext
+
+
+LIKES_MILESTONE = 20
+
+
+def migrate(migrator: Migrator, database: pw.Database, *, fake=False):
+    """Write your migrations here."""
+
+    @migrator.create_model
+    class PostStats(pw.Model):
+        post = pw.ForeignKeyField(column_name='post_id', field='id', model=migrator.orm['post'], on_delete='CASCADE', primary_key=True)
+        like_count = pw.IntegerField(default=0)
+        repost_count = pw.IntegerField(default=0)
+        last_like_at = pw.DateTimeField(null=True)
+        like_milestone_at = pw.DateTimeField(index=True, null=True)
+        last_repost_uri = pw.CharField(max_length=255, null=True)
+        last_repost_at = pw.DateTimeField(null=True)
+
+        class Meta:
+            table_name = "poststats"
+
+    # Counters of the interactions already indexed
+    migrator.sql(f"""
+        INSERT INTO poststats (post_id, like_count, repost_count, last_like_at, like_milestone_at, last_repost_uri, last_repost_at)
+        SELECT
+            post_id,
+            count(*) FILTER (WHERE interaction_type = 0),
+            count(*) FILTER (WHERE interaction_type = 1),
+            max(created_at) FILTER (WHERE interaction_type = 0),
+            (array_agg(created_at ORDER BY created_at) FILTER (WHERE interaction_type = 0))[{LIKES_MILESTONE}],
+            (array_agg(uri ORDER BY created_at DESC) FILTER (WHERE interaction_type = 1))[1],
+            max(created_at) FILTER (WHERE interaction_type = 1)
+        FROM interaction
+        GROUP BY post_id
+        ON CONFLICT (post_id) DO NOTHING
+    """)
+
+
+def rollback(migrator: Migrator, database: pw.Database, *, fake=False):
+    """Write your rollback migrations here."""
+
+    migrator.remove_model('poststats')
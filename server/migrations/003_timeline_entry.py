@@ -0,0 +1,35 @@
+"""Peewee migrations -- 003_timeline_entry.py."""
+
+from contextlib import suppress
+
+import peewee as pw
+from peewee_migrate import Migrator
+
+
+with suppress(ImportError):
+    import playhouse.postgres_ext as pw_pext
+
+
+def migrate(migrator: Migrator, database: pw.Database, *, fake=False):
+    """Write your migrations here."""
+
+    # The feed server fills it in from the indexed posts on startup
+    @migrator.create_model
+    class TimelineEntry(pw.Model):
+        id = pw.AutoField()
+        timeline = pw.IntegerField()
+        post = pw.ForeignKeyField(column_name='post_id', field='id', model=migrator.orm['post'], on_delete='CASCADE')
+        uri = pw.CharField(max_length=255)
+        cid = pw.CharField(max_length=255)
+        repost_uri = pw.CharField(max_length=255, null=True)
+        created_at = pw.DateTimeField()
+
+        class Meta:
+            table_name = "timelineentry"
+            indexes = [(('timeline', 'post'), True), (('timeline', 'created_at', 'cid'), False)]
+
+
+def rollback(migrator: Migrator, database: pw.Database, *, fake=False):
+    """Write your rollback migrations here."""
+
+    migrator.remove_model('timelineentry')
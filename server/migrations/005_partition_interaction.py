@@ -0,0 +1,95 @@
+"""Peewee migrations -- 005_partition_interaction.py."""
+
+from contextlib import suppress
+
+import peewee as pw
+from peewee_migrate import Migrator
+
+
+with suppress(ImportError):
+    import playhouse.postgres_ext as pw_pext
+
+
+INDEXES = """
+    CREATE INDEX "interaction_author_id" ON "interaction" ("author_id");
+    CREATE INDEX "interaction_post_id" ON "interaction" ("post_id");
+    CREATE INDEX "interaction_interaction_type" ON "interaction" ("interaction_type");
+    CREATE INDEX "interaction_created_at" ON "interaction" ("created_at");
+    CREATE INDEX "interaction_author_id_interaction_type_created_at" ON "interaction" ("author_id", "interaction_type", "created_at");
+"""
+
+
+def migrate(migrator: Migrator, database: pw.Database, *, fake=False):
+    """Write your migrations here."""
+
+    # Partitioned by indexed_at, set by the indexer, as created_at is set by the client and may be far off.
+    # Unique keys of partitioned tables must hold the partition key, so uri can't be unique any more.
+    # The indexer skips stored uris instead, which relies on each repo being handled by one worker only.
+    migrator.sql("""
+        ALTER TABLE "interaction" RENAME TO "interaction_unpartitioned";
+        ALTER SEQUENCE "interaction_id_seq" OWNED BY NONE;
+
+        CREATE TABLE "interaction" (
+            "id" INTEGER NOT NULL DEFAULT nextval('interaction_id_seq'),
+            "uri" VARCHAR(255) NOT NULL,
+            "cid" VARCHAR(255) NOT NULL,
+            "author_id" INTEGER NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE,
+            "post_id" INTEGER NOT NULL REFERENCES "post" ("id") ON DELETE CASCADE,
+            "interaction_type" INTEGER NOT NULL,
+            "indexed_at" TIMESTAMP NOT NULL,
+            "created_at" TIMESTAMP NOT NULL,
+            PRIMARY KEY ("id", "indexed_at")
+        ) PARTITION BY RANGE ("indexed_at");
+        ALTER SEQUENCE "interaction_id_seq" OWNED BY "interaction"."id";
+
+        CREATE TABLE "interaction_default" PARTITION OF "interaction" DEFAULT;
+
+        DO $$
+        DECLARE
+            day DATE;
+        BEGIN
+            FOR day IN SELECT generate_series(current_date - 7, current_date + 7, '1 day')::DATE LOOP
+                EXECUTE 'CREATE TABLE ' || quote_ident('interaction_p' || to_char(day, 'YYYYMMDD'))
+                    || ' PARTITION OF "interaction" FOR VALUES FROM (' || quote_literal(day)
+                    || ') TO (' || quote_literal(day + 1) || ')';
+            END LOOP;
+        END $$;
+
+        INSERT INTO "interaction"
+        SELECT "id", "uri", "cid", "author_id", "post_id", "interaction_type", "indexed_at", COALESCE("created_at", "indexed_at")
+        FROM "interaction_unpartitioned";
+
+        DROP TABLE "interaction_unpartitioned";
+
+        CREATE INDEX "interaction_uri" ON "interaction" ("uri");
+    """ + INDEXES)
+
+
+def rollback(migrator: Migrator, database: pw.Database, *, fake=False):
+    """Write your rollback migrations here."""
+
+    migrator.sql("""
+        ALTER TABLE "interaction" RENAME TO "interaction_partitioned";
+        ALTER SEQUENCE "interaction_id_seq" OWNED BY NONE;
+
+        CREATE TABLE "interaction" (
+            "id" INTEGER NOT NULL DEFAULT nextval('interaction_id_seq') PRIMARY KEY,
+            "uri" VARCHAR(255) NOT NULL,
+            "cid" VARCHAR(255) NOT NULL,
+            "author_id" INTEGER NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE,
+            "post_id" INTEGER NOT NULL REFERENCES "post" ("id") ON DELETE CASCADE,
+            "interaction_type" INTEGER NOT NULL,
+            "indexed_at" TIMESTAMP NOT NULL,
+            "created_at" TIMESTAMP
+        );
+        ALTER SEQUENCE "interaction_id_seq" OWNED BY "interaction"."id";
+
+        INSERT INTO "interaction"
+        SELECT DISTINCT ON ("uri") "id", "uri", "cid", "author_id", "post_id", "interaction_type", "indexed_at", "created_at"
+        FROM "interaction_partitioned"
+        ORDER BY "uri", "created_at";
+
+        DROP TABLE "interaction_partitioned";
+
+        CREATE UNIQUE INDEX "interaction_uri" ON "interaction" ("uri");
+    """ + INDEXES)
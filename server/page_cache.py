@@ -0,0 +1,240 @@
+import asyncio
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from redis.exceptions import RedisError
+
+from server import config, metrics
+from server.logger import logger
+
+redis = Redis(host="redis")
+async_redis = AsyncRedis(host="redis")
+
+_KEY = "bsky-feed-pages:{}:{}:{}"
+_LOCK_KEY = "bsky-feed-pages:{}:{}:{}:{}:lock"
+_LOCK_TIMEOUT = 5
+_WAIT_INTERVAL = 0.02
+
+# Requests waiting for a page another request computes count as misses
+_HITS = metrics.CACHE_LOOKUPS.labels('feed_pages', 'hit')
+_MISSES = metrics.CACHE_LOOKUPS.labels('feed_pages', 'miss')
+
+# Requests for the same page within this process wait for each other rather than for Redis,
+# lock key -> [lock, requests holding or waiting for it]
+_local_locks = {}
+_local_locks_lock = threading.Lock()
+_in_flight = {}
+
+
+@contextmanager
+def _local_lock(lock_key):
+    with _local_locks_lock:
+        entry = _local_locks.setdefault(lock_key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _local_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _local_locks[lock_key]
+
+
+def _unavailable(error):
+    # Without Redis, pages are computed on every request as if they weren't cached
+    logger.warning(f'Page cache unavailable: {error!r}')
+
+
+def _read(key, limit):
+    try:
+        body = redis.hget(key, limit)
+    except RedisError as e:
+        _unavailable(e)
+        return None
+    return json.loads(body) if body is not None else None
+
+
+def _write(key, limit, body):
+    try:
+        pipe = redis.pipeline(transaction=False)
+        pipe.hset(key, limit, json.dumps(body))
+        pipe.expire(key, config.PAGE_CACHE_TTL)
+        pipe.execute()
+    except RedisError as e:
+        _unavailable(e)
+
+
+def _lock(lock_key):
+    try:
+        return redis.set(lock_key, 1, nx=True, ex=_LOCK_TIMEOUT)
+    except RedisError as e:
+        _unavailable(e)
+        return True
+
+
+def _unlock(lock_key):
+    try:
+        redis.delete(lock_key)
+    except RedisError as e:
+        _unavailable(e)
+
+
+def _locked(lock_key):
+    try:
+        return redis.exists(lock_key)
+    except RedisError as e:
+        _unavailable(e)
+        return False
+
+
+def get(feed: str, cursor: Optional[str], limit: int, requester_did: Optional[str], compute) -> dict:
+    """Get a feed page from the page cache, computing it once for all concurrent requests on a miss.
+
+    Pages of the same feed and cursor share a Redis hash with a field per limit, so all the head
+    pages of a feed go away with a single :obj:`invalidate`.
+
+    Args:
+        feed: Feed URI.
+        cursor: Page cursor, if any.
+        limit: Page size.
+        requester_did: DID of the requester for personalized feeds, ``None`` for feeds shared by everyone.
+        compute: Function computing the page when it's not cached.
+
+    Returns:
+        :obj:`dict`: Page body.
+    """
+    key = _KEY.format(feed, requester_did or '', cursor or '')
+
+    body = _read(key, limit)
+    if body is not None:
+        _HITS.inc()
+        return body
+
+    _MISSES.inc()
+    lock_key = _LOCK_KEY.format(feed, requester_did or '', cursor or '', limit)
+    with _local_lock(lock_key):
+        body = _read(key, limit)
+        if body is not None:
+            return body
+
+        if _lock(lock_key):
+            try:
+                body = compute()
+                _write(key, limit, body)
+                return body
+            finally:
+                _unlock(lock_key)
+
+        # Another process is computing the page, wait for it unless it takes too long
+        deadline = time.monotonic() + _LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(_WAIT_INTERVAL)
+            body = _read(key, limit)
+            if body is not None:
+                return body
+            if not _locked(lock_key):
+                break
+
+        return compute()
+
+
+async def _read_async(key, limit):
+    try:
+        body = await async_redis.hget(key, limit)
+    except RedisError as e:
+        _unavailable(e)
+        return None
+    return json.loads(body) if body is not None else None
+
+
+async def _write_async(key, limit, body):
+    try:
+        pipe = async_redis.pipeline(transaction=False)
+        pipe.hset(key, limit, json.dumps(body))
+        pipe.expire(key, config.PAGE_CACHE_TTL)
+        await pipe.execute()
+    except RedisError as e:
+        _unavailable(e)
+
+
+async def _lock_async(lock_key):
+    try:
+        return await async_redis.set(lock_key, 1, nx=True, ex=_LOCK_TIMEOUT)
+    except RedisError as e:
+        _unavailable(e)
+        return True
+
+
+async def _unlock_async(lock_key):
+    try:
+        await async_redis.delete(lock_key)
+    except RedisError as e:
+        _unavailable(e)
+
+
+async def _locked_async(lock_key):
+    try:
+        return await async_redis.exists(lock_key)
+    except RedisError as e:
+        _unavailable(e)
+        return False
+
+
+async def _compute_async(key, lock_key, limit, compute):
+    if await _lock_async(lock_key):
+        try:
+            body = await compute()
+            await _write_async(key, limit, body)
+            return body
+        finally:
+            await _unlock_async(lock_key)
+
+    deadline = time.monotonic() + _LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(_WAIT_INTERVAL)
+        body = await _read_async(key, limit)
+        if body is not None:
+            return body
+        if not await _locked_async(lock_key):
+            break
+
+    return await compute()
+
+
+async def get_async(feed: str, cursor: Optional[str], limit: int, requester_did: Optional[str], compute) -> dict:
+    """Same as :obj:`get`, on the async Redis client and with ``compute`` returning a coroutine."""
+    key = _KEY.format(feed, requester_did or '', cursor or '')
+
+    body = await _read_async(key, limit)
+    if body is not None:
+        _HITS.inc()
+        return body
+
+    _MISSES.inc()
+    lock_key = _LOCK_KEY.format(feed, requester_did or '', cursor or '', limit)
+    task = _in_flight.get(lock_key)
+    if task is None:
+        task = asyncio.ensure_future(_compute_async(key, lock_key, limit, compute))
+        _in_flight[lock_key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(lock_key, None))
+
+    # A cancelled request must not cancel the page other requests are waiting for
+    return await asyncio.shield(task)
+
+
+def invalidate(feeds, pipeline=None) -> None:
+    """Drop the cached head pages of feeds with new posts.
+
+    Args:
+        feeds: URIs of the feeds.
+        pipeline: Redis pipeline to queue the command on, it's sent right away if missing.
+    """
+    keys = [_KEY.format(feed, '', '') for feed in feeds if feed]
+    if keys:
+        (pipeline if pipeline is not None else redis).delete(*keys)
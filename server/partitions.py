@@ -0,0 +1,100 @@
+"""Daily partitions of the interaction table.
+
+Rows land in the partition of their ``indexed_at`` day, set by the indexer, or in
+``interaction_default`` if it doesn't exist yet. Retention drops whole partitions instead of
+deleting rows.
+"""
+from datetime import date, datetime, timedelta
+
+from server.database import db, Interaction
+from server.logger import logger
+
+_TABLE = Interaction._meta.table_name
+_PARTITION = _TABLE + "_p{:%Y%m%d}"
+_DEFAULT_PARTITION = _TABLE + "_default"
+
+
+def _partition_days():
+    cursor = db.execute_sql(
+        """
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = %s
+        """,
+        (_TABLE,),
+    )
+
+    days = []
+    for name, in cursor.fetchall():
+        if name != _DEFAULT_PARTITION:
+            days.append(datetime.strptime(name[len(_TABLE) + 2:], "%Y%m%d").date())
+    return sorted(days)
+
+
+def _in_default_partition(day):
+    cursor = db.execute_sql(
+        f'SELECT EXISTS (SELECT 1 FROM "{_DEFAULT_PARTITION}" WHERE "indexed_at" >= %s AND "indexed_at" < %s)',
+        (day, day + timedelta(days=1)),
+    )
+    return cursor.fetchone()[0]
+
+
+def _create_partition(day):
+    partition = _PARTITION.format(day)
+    bounds = (day, day + timedelta(days=1))
+
+    with db.atomic():
+        if not _in_default_partition(day):
+            db.execute_sql(f'CREATE TABLE "{partition}" PARTITION OF "{_TABLE}" FOR VALUES FROM (%s) TO (%s)', bounds)
+            return 0
+
+        # A partition can't be created over rows of the default one, so they are moved to it first
+        db.execute_sql(f'CREATE TABLE "{partition}" (LIKE "{_TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        moved = db.execute_sql(
+            f"""
+            WITH moved AS (
+                DELETE FROM "{_DEFAULT_PARTITION}" WHERE "indexed_at" >= %s AND "indexed_at" < %s RETURNING *
+            )
+            INSERT INTO "{partition}" SELECT * FROM moved
+            """,
+            bounds,
+        ).rowcount
+        db.execute_sql(f'ALTER TABLE "{_TABLE}" ATTACH PARTITION "{partition}" FOR VALUES FROM (%s) TO (%s)', bounds)
+        return moved
+
+
+def create(days_ahead: int, days_behind: int = 0) -> None:
+    """Create the partitions from ``days_behind`` days ago up to ``days_ahead`` days ahead.
+
+    Rows of those days already in the default partition are moved to their new partition.
+    """
+    existing = set(_partition_days())
+    # indexed_at is stored in UTC
+    today = datetime.utcnow().date()
+
+    for offset in range(-days_behind, days_ahead + 1):
+        day = today + timedelta(days=offset)
+        if day in existing:
+            continue
+
+        try:
+            moved = _create_partition(day)
+        except Exception:
+            logger.exception(f"Error creating partition {_PARTITION.format(day)}")
+            continue
+
+        logger.info(f"Created partition {_PARTITION.format(day)}" + (f", moved {moved} rows into it" if moved else ""))
+
+
+def drop(before: date) -> None:
+    """Drop the partitions of the days before ``before``, and the rows of those days in the default partition."""
+    for day in _partition_days():
+        if day >= before:
+            break
+
+        db.execute_sql(f'DROP TABLE "{_PARTITION.format(day)}"')
+        logger.info(f"Dropped partition {_PARTITION.format(day)}")
+
+    db.execute_sql(f'DELETE FROM "{_DEFAULT_PARTITION}" WHERE "indexed_at" < %s', (before,))
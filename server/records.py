@@ -0,0 +1,119 @@
+"""Compact records of the firehose creates we index, read straight from their decoded DAG-CBOR.
+
+They replace the models of the AT Protocol SDK on the ingestion path: only the fields the indexer
+uses are kept and checked, without allocating anything else. ``from_raw`` returns ``None`` for a
+record missing any of them or holding a value the database would reject, which is skipped like a
+record failing validation was, instead of rolling back the whole batch it would be written with.
+"""
+from datetime import datetime
+
+from atproto import models
+from dateutil import parser
+
+# Length of the VARCHAR columns the strings of a record are stored in
+_MAX_LENGTH = 255
+
+
+def _string(value, max_length=_MAX_LENGTH):
+    if not isinstance(value, str):
+        raise TypeError(f'Expected a string, got {type(value).__name__}')
+    if max_length is not None and (len(value) > max_length or '\x00' in value):
+        raise ValueError('String too long or holding a NUL character')
+    return value
+
+
+def _datetime(value) -> datetime:
+    # dateutil raises ParserError, a ValueError, or OverflowError for out of range values
+    try:
+        return parser.parse(_string(value))
+    except OverflowError as e:
+        raise ValueError(str(e)) from e
+
+
+class Post:
+    __slots__ = ('uri', 'cid', 'author', 'text', 'langs', 'reply_parent', 'reply_root', 'created_at')
+
+    def __init__(self, uri, cid, author, text, langs, reply_parent, reply_root, created_at):
+        self.uri = uri
+        self.cid = cid
+        self.author = author
+        self.text = text
+        self.langs = langs
+        self.reply_parent = reply_parent
+        self.reply_root = reply_root
+        self.created_at = created_at
+
+    @classmethod
+    def from_raw(cls, uri, cid, author, raw):
+        reply = raw.get('reply')
+        langs = raw.get('langs') or []
+        if not isinstance(langs, list):
+            raise TypeError('langs is not a list')
+        return cls(
+            uri,
+            cid,
+            author,
+            _string(raw['text'], max_length=None),
+            [_string(lang) for lang in langs],
+            _string(reply['parent']['uri']) if reply else None,
+            _string(reply['root']['uri']) if reply else None,
+            _datetime(raw['createdAt']),
+        )
+
+
+class Interaction:
+    """A like or a repost."""
+
+    __slots__ = ('uri', 'cid', 'author', 'subject_uri', 'subject_cid', 'created_at')
+
+    def __init__(self, uri, cid, author, subject_uri, subject_cid, created_at):
+        self.uri = uri
+        self.cid = cid
+        self.author = author
+        self.subject_uri = subject_uri
+        self.subject_cid = subject_cid
+        self.created_at = created_at
+
+    @classmethod
+    def from_raw(cls, uri, cid, author, raw):
+        subject = raw['subject']
+        return cls(uri, cid, author, _string(subject['uri']), _string(subject['cid']), _datetime(raw['createdAt']))
+
+
+class Follow:
+    __slots__ = ('uri', 'cid', 'author', 'subject')
+
+    def __init__(self, uri, cid, author, subject):
+        self.uri = uri
+        self.cid = cid
+        self.author = author
+        self.subject = subject
+
+    @classmethod
+    def from_raw(cls, uri, cid, author, raw):
+        return cls(uri, cid, author, _string(raw['subject']))
+
+
+_RECORDS = {
+    models.ids.AppBskyFeedPost: Post,
+    models.ids.AppBskyFeedLike: Interaction,
+    models.ids.AppBskyFeedRepost: Interaction,
+    models.ids.AppBskyGraphFollow: Follow,
+}
+
+COLLECTIONS = frozenset(_RECORDS)
+
+
+def from_raw(collection, uri, cid, author, raw):
+    """Build the record of a create in one of :obj:`COLLECTIONS` from its decoded block.
+
+    Returns:
+        The record, or ``None`` if the block isn't a valid record of that collection.
+    """
+    if not isinstance(raw, dict) or raw.get('$type') != collection:
+        return None
+
+    try:
+        return _RECORDS[collection].from_raw(_string(uri), _string(cid), author, raw)
+    except (KeyError, TypeError, ValueError):
+        return None
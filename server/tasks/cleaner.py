@@ -1,19 +1,92 @@
+"""Retention of old posts and interactions.
+
+Interactions expire with their daily partition. Posts are walked in chunks of ids, each chunk
+deleted in its own short transaction, so the work is spread over the day instead of locking the
+tables once.
+"""
 import datetime
 import time
 
-from server.database import Post, Interaction, PostLanguage
+from peewee import fn
+
+from server import config, partitions
+from server.database import db, Interaction, Post, PostLanguage, PostStats, TimelineEntry
+from server.logger import logger
+
+# Chunks between two progress reports
+_PROGRESS_EVERY = 100
+
+
+def _wait(stop_event, seconds):
+    if stop_event is None:
+        time.sleep(seconds)
+        return False
+    return stop_event.wait(seconds)
+
+
+def _delete_chunk(first_id, last_id, expired_before):
+    with db.atomic():
+        # Locked so the indexer can't refresh them in between, it waits for the chunk instead
+        post_ids = [
+            post.id
+            for post in Post.select(Post.id).where(
+                Post.id.between(first_id, last_id),
+                Post.indexed_at <= expired_before,
+            ).for_update()
+        ]
+        if not post_ids:
+            return 0
+
+        # Dependent rows are removed explicitly, by index, rather than by a cascade fired per post
+        Interaction.delete().where(Interaction.post.in_(post_ids)).execute()
+        PostLanguage.delete().where(PostLanguage.post.in_(post_ids)).execute()
+        PostStats.delete().where(PostStats.post.in_(post_ids)).execute()
+        TimelineEntry.delete().where(TimelineEntry.post.in_(post_ids)).execute()
+        return Post.delete().where(Post.id.in_(post_ids)).execute()
+
+
+def clean(stop_event=None):
+    """Delete the posts not indexed within the retention period.
+
+    Returns:
+        :obj:`int`: Number of posts deleted.
+    """
+    started_at = time.monotonic()
+    expired_before = datetime.datetime.utcnow() - datetime.timedelta(days=config.RETENTION_DAYS)
+
+    # Posts indexed after the pass started are never expired
+    first_id, max_id = Post.select(fn.MIN(Post.id), fn.MAX(Post.id)).scalar(as_tuple=True)
+    if first_id is None:
+        return 0
+
+    deleted = chunks = 0
+    while first_id <= max_id:
+        last_id = first_id + config.CLEANER_CHUNK_SIZE - 1
+        deleted += _delete_chunk(first_id, last_id, expired_before)
+
+        chunks += 1
+        if chunks % _PROGRESS_EVERY == 0:
+            elapsed = time.monotonic() - started_at
+            logger.info(f'Cleaner at post id {last_id} of {max_id}, {deleted} deleted ({deleted / elapsed:.0f} rows/s)')
+
+        first_id = last_id + 1
+        if _wait(stop_event, config.CLEANER_CHUNK_PAUSE):
+            break
+
+    elapsed = time.monotonic() - started_at
+    logger.info(f'Cleaner deleted {deleted} posts in {elapsed:.0f}s ({deleted / elapsed:.0f} rows/s)')
+    return deleted
 
 
 def run(stop_event=None):
     while stop_event is None or not stop_event.is_set():
-        now = datetime.datetime.now()
-        PostLanguage.delete().where(
-            PostLanguage.post.in_(
-                Post.select(Post.id).where(Post.indexed_at <= now - datetime.timedelta(days=7))
-            )
-        ).execute()
-        Interaction.delete().where(Interaction.indexed_at <= now - datetime.timedelta(days=7)).execute()
-        Post.delete().where(Post.indexed_at <= now - datetime.timedelta(days=7)).execute()
-
-        time.sleep(86400)  # 1 day
-        continue
+        started_at = time.monotonic()
+
+        try:
+            partitions.create(config.PARTITION_DAYS_AHEAD)
+            partitions.drop(datetime.datetime.utcnow().date() - datetime.timedelta(days=config.RETENTION_DAYS))
+            clean(stop_event)
+        except Exception:
+            logger.exception('Error cleaning old posts')
+
+        _wait(stop_event, max(config.CLEANER_INTERVAL - (time.monotonic() - started_at), 0))
@@ -1,18 +1,48 @@
 import datetime
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 
+from peewee import Cast, ValuesList
 from redis import Redis
 from atproto_client.client.client import Client
 
-from server.database import User
+from server import config, metrics, timelines
+from server.database import User, Language
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-QUEUE_NAME = "bsky-statistics"
-QUEUE_INDEX = "bsky-statistics-index"
+# Sorted set of DIDs scored by the time their update is due, popped lowest first
+QUEUE_NAME = "bsky-statistics-queue"
+
+# Statistics are refreshed once this old
+UPDATE_INTERVAL = datetime.timedelta(days=1)
+
+# Most actors app.bsky.actor.getProfiles accepts per call
+PROFILES_BATCH_SIZE = 25
+
+
+class RateLimiter:
+    """Spaces out calls shared by several threads so they don't exceed ``rate`` per second."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+
+        self._lock = threading.Lock()
+        self._next_at = time.monotonic()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_at - now
+            self._next_at = max(self._next_at, now) + self.interval
+
+        if wait > 0:
+            time.sleep(wait)
 
 
 class StatisticsUpdater(Thread):
@@ -25,29 +55,90 @@ class StatisticsUpdater(Thread):
             os.environ.get("STATISTICS_PASSWORD")
         )
         self.redis = Redis(host="redis")
+        self.rate_limiter = RateLimiter(config.STATISTICS_RATE_LIMIT)
 
-    def run(self, stop_event=None):
-        while stop_event is None or not stop_event.is_set():
-            _, user_did = self.redis.brpop(QUEUE_NAME)
-            user_did = user_did.decode()
-            self.redis.srem(QUEUE_INDEX, user_did)
+    def _feature_top_account(self, user):
+        language = Language.get_or_none(Language.code == timelines.TOP_SPANISH_LANGUAGE)
+        if language:
+            timelines.add_top_account(language.id, user.id)
 
-            try:
-                now = datetime.datetime.now()
-                user = User.get(did=user_did)
+    def _pop(self):
+        item = self.redis.bzpopmin(QUEUE_NAME, timeout=1)
+        if not item:
+            return []
 
-                if user.last_update is None or user.last_update < now - datetime.timedelta(days=1):
-                    profile = self.client.get_profile(user_did)
+        dids = [item[1]]
+        dids.extend(did for did, _ in self.redis.zpopmin(QUEUE_NAME, PROFILES_BATCH_SIZE * config.STATISTICS_CONCURRENCY - 1))
+        return [did.decode() for did in dids]
 
-                    user.handle = profile.handle
-                    user.followers_count = profile.followers_count
-                    user.follows_count = profile.follows_count
-                    user.posts_count = profile.posts_count
-                    user.last_update = now
+    def _get_profiles(self, dids):
+        self.rate_limiter.acquire()
+        return self.client.get_profiles(dids).profiles
 
-                    user.save()
+    def _update_users(self, users, profiles, now):
+        """Update the statistics of a batch of users in a single statement.
 
+        Args:
+            users: Users by DID, as they were before the update.
+            profiles: Fetched profiles of those users.
+            now: Update time.
+        """
+        rows = [
+            (profile.did, profile.handle, profile.followers_count, profile.follows_count, profile.posts_count)
+            for profile in profiles
+            if profile.did in users
+        ]
+        if not rows:
+            return
+
+        values = ValuesList(rows, columns=("did", "handle", "followers_count", "follows_count", "posts_count"), alias="v")
+        User.update(
+            handle=values.c.handle,
+            # Columns of missing counts only hold NULLs, which Postgres would take for text
+            followers_count=Cast(values.c.followers_count, "integer"),
+            follows_count=Cast(values.c.follows_count, "integer"),
+            posts_count=Cast(values.c.posts_count, "integer"),
+            last_update=now,
+        ).from_(values).where(User.did == values.c.did).execute()
+
+        for did, _, followers_count, _, _ in rows:
+            user = users[did]
+            was_top_account = (user.followers_count or 0) >= config.TOP_ACCOUNT_FOLLOWERS
+            if not was_top_account and followers_count and followers_count >= config.TOP_ACCOUNT_FOLLOWERS:
+                self._feature_top_account(user)
+
+    def _update(self, executor, dids):
+        now = datetime.datetime.now()
+        users = {
+            user.did: user
+            for user in User.select().where(
+                User.did.in_(dids),
+                User.last_update.is_null(True) | (User.last_update < now - UPDATE_INTERVAL),
+            )
+        }
+
+        outdated = list(users)
+        batches = [outdated[i:i + PROFILES_BATCH_SIZE] for i in range(0, len(outdated), PROFILES_BATCH_SIZE)]
+        futures = [(batch, executor.submit(self._get_profiles, batch)) for batch in batches]
+
+        for batch, future in futures:
+            try:
+                self._update_users(users, future.result(), now)
             except Exception:
-                logger.exception(f"Error updating statistics for DID: {user_did}", exc_info=True)
+                logger.exception(f"Error updating statistics for {len(batch)} users, starting at DID: {batch[0]}")
+
+    def run(self, stop_event=None):
+        with ThreadPoolExecutor(max_workers=config.STATISTICS_CONCURRENCY) as executor:
+            while stop_event is None or not stop_event.is_set():
+                dids = self._pop()
+                if not dids:
+                    continue
+
+                try:
+                    self._update(executor, dids)
+                except Exception:
+                    logger.exception(f"Error updating statistics for {len(dids)} users")
 
-            logger.info(f"{self.redis.llen(QUEUE_NAME)} users pending for update")
+                pending = self.redis.zcard(QUEUE_NAME)
+                metrics.QUEUE_DEPTH.labels('statistics').set(pending)
+                logger.info(f"{pending} users pending for update")
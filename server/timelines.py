@@ -0,0 +1,146 @@
+from peewee import EXCLUDED, Value
+
+from server import config
+from server.database import db, Language, Post, User, Interaction, PostLanguage, PostStats, TimelineEntry
+from server.logger import logger
+
+# Language of the posts featured by the top Spanish timeline
+TOP_SPANISH_LANGUAGE = 'es'
+
+# Key of the Postgres advisory lock held while the top Spanish timeline is rebuilt
+_REBUILD_LOCK_KEY = 0x7469_6d65
+
+_FIELDS = [
+    TimelineEntry.timeline,
+    TimelineEntry.post,
+    TimelineEntry.uri,
+    TimelineEntry.cid,
+    TimelineEntry.created_at,
+]
+_REPOST_FIELDS = _FIELDS + [TimelineEntry.repost_uri]
+
+
+def _upsert(query, fields):
+    # A post is featured once per timeline, by its latest reason
+    return len(TimelineEntry.insert_from(query, fields).on_conflict(
+        conflict_target=[TimelineEntry.timeline, TimelineEntry.post],
+        update={
+            TimelineEntry.created_at: EXCLUDED.created_at,
+            TimelineEntry.repost_uri: EXCLUDED.repost_uri,
+        },
+        where=(EXCLUDED.created_at > TimelineEntry.created_at),
+    ).returning(TimelineEntry.id).tuples().execute())
+
+
+def _posts_from_top_accounts(language_id, *where):
+    return Post.select(
+        Value(TimelineEntry.TOP_SPANISH), Post.id, Post.uri, Post.cid, Post.created_at,
+    ).join(
+        PostLanguage, on=(PostLanguage.post == Post.id)
+    ).join_from(
+        Post, User, on=(User.id == Post.author)
+    ).where(
+        PostLanguage.language == language_id,
+        Post.reply_root.is_null(True),
+        Post.created_at.is_null(False),
+        User.followers_count >= config.TOP_ACCOUNT_FOLLOWERS,
+        *where,
+    )
+
+
+def _reposts_from_top_accounts(language_id, *where):
+    # Only the latest repost of each post, a single statement can't update a row twice
+    return Interaction.select(
+        Value(TimelineEntry.TOP_SPANISH), Post.id, Post.uri, Post.cid, Interaction.created_at, Interaction.uri,
+    ).join(
+        Post, on=(Post.id == Interaction.post)
+    ).join(
+        PostLanguage, on=(PostLanguage.post == Post.id)
+    ).join_from(
+        Interaction, User, on=(User.id == Interaction.author)
+    ).where(
+        PostLanguage.language == language_id,
+        Interaction.interaction_type == Interaction.REPOST,
+        Interaction.created_at.is_null(False),
+        User.followers_count >= config.TOP_ACCOUNT_FOLLOWERS,
+        *where,
+    ).distinct(
+        Post.id
+    ).order_by(
+        Post.id,
+        Interaction.created_at.desc(),
+    )
+
+
+def _posts_with_likes_milestone(language_id, *where):
+    return Post.select(
+        Value(TimelineEntry.TOP_SPANISH), Post.id, Post.uri, Post.cid, PostStats.like_milestone_at,
+    ).join(
+        PostStats, on=(PostStats.post == Post.id)
+    ).join_from(
+        Post, PostLanguage, on=(PostLanguage.post == Post.id)
+    ).join_from(
+        Post, User, on=(User.id == Post.author)
+    ).where(
+        PostLanguage.language == language_id,
+        PostStats.like_milestone_at.is_null(False),
+        User.followers_count < config.TOP_ACCOUNT_FOLLOWERS,
+        *where,
+    )
+
+
+def add_top_spanish(language_id, post_ids, repost_uris, milestone_post_ids):
+    """Feature the posts of a freshly written batch on the top Spanish timeline.
+
+    Args:
+        language_id: Id of the Spanish language.
+        post_ids: Ids of the new posts.
+        repost_uris: URIs of the new reposts.
+        milestone_post_ids: Ids of the posts that just reached ``config.LIKES_MILESTONE`` likes.
+
+    Returns:
+        :obj:`int`: Number of entries added or moved to the top of the timeline.
+    """
+    featured = 0
+    if post_ids:
+        featured += _upsert(_posts_from_top_accounts(language_id, Post.id.in_(post_ids)), _FIELDS)
+    if repost_uris:
+        featured += _upsert(_reposts_from_top_accounts(language_id, Interaction.uri.in_(repost_uris)), _REPOST_FIELDS)
+    if milestone_post_ids:
+        featured += _upsert(_posts_with_likes_milestone(language_id, Post.id.in_(milestone_post_ids)), _FIELDS)
+    return featured
+
+
+def add_top_account(language_id, user_id):
+    """Feature the indexed posts and reposts of an author who just became a top account."""
+    _upsert(_posts_from_top_accounts(language_id, Post.author == user_id), _FIELDS)
+    _upsert(_reposts_from_top_accounts(language_id, Interaction.author == user_id), _REPOST_FIELDS)
+
+
+@db.connection_context()
+def rebuild_top_spanish(language_id):
+    """Feature every indexed post that qualifies on the top Spanish timeline.
+
+    Meant for an empty timeline, the indexer and the statistics updater keep it up to date afterwards.
+    A rebuild already running in another process is left alone.
+    """
+    if not db.execute_sql('SELECT pg_try_advisory_lock(%s)', (_REBUILD_LOCK_KEY,)).fetchone()[0]:
+        logger.info('Top Spanish timeline is already being rebuilt')
+        return
+
+    try:
+        _upsert(_posts_from_top_accounts(language_id), _FIELDS)
+        _upsert(_reposts_from_top_accounts(language_id), _REPOST_FIELDS)
+        _upsert(_posts_with_likes_milestone(language_id), _FIELDS)
+        logger.info('Rebuilt top Spanish timeline')
+    finally:
+        db.execute_sql('SELECT pg_advisory_unlock(%s)', (_REBUILD_LOCK_KEY,))
+
+
+@db.connection_context()
+def rebuild_top_spanish_if_empty():
+    """Rebuild the top Spanish timeline if it has no entries yet, as on a freshly migrated database."""
+    language = Language.get_or_none(Language.code == TOP_SPANISH_LANGUAGE)
+    empty = not TimelineEntry.select().where(TimelineEntry.timeline == TimelineEntry.TOP_SPANISH).exists()
+    if language and empty:
+        rebuild_top_spanish(language.id)
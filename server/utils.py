@@ -2,38 +2,37 @@ import re
 
 import peewee
 
+_EMOJI = (
+    "["
+    u"\U0001F600-\U0001F64F"  # emoticons
+    u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+    u"\U0001F680-\U0001F6FF"  # transport & map symbols
+    u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    u"\U00002702-\U000027B0"
+    u"\U0001F900-\U0001F9FF"
+    "]+"
+)
 
-def remove_emoji(text):
-    """Removes all emojis from a string using regular expressions."""
-    emoji_pattern = re.compile("["
-                               u"\U0001F600-\U0001F64F"  # emoticons
-                               u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-                               u"\U0001F680-\U0001F6FF"  # transport & map symbols
-                               u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-                               u"\U00002702-\U000027B0"
-                               u"\U0001f900-\U0001f9ff"
-                               u"\U0001f300-\U0001f5ff"
-                               u"\U0001f600-\U0001f64f"
-                               u"\U0001f680-\U0001f6ff"
-                               u"\U0001f1e0-\U0001f1ff"
-                               u"\U00002702-\U000027b0"
-                               u"\U0001f900-\U0001f9ff"
-                               u"\U0001f300-\U0001f5ff"
-                               u"\U0001f600-\U0001f64f"
-                               u"\U0001f680-\U0001f6ff"
-                               u"\U0001f1e0-\U0001f1ff"
-                               u"\U00002702-\U000027b0"
-                               u"\U0001f900-\U0001f9ff"
-                               "]+", flags=re.UNICODE)
-    return emoji_pattern.sub(r"", text)
+# Everything normalize_text touches, as one alternation applied in a single pass
+_NORMALIZE_PATTERN = re.compile(
+    r"(?P<break>\n[.\s]*|\.[.\s]+)"  # line breaks and consecutive dots, along with the ones following them
+    r"|[^\s.]+(?:\.[^\s.]+)+\S*"  # urls
+    r"|[@#]\S*"  # handles and hashtags
+    r"|" + _EMOJI,
+    flags=re.UNICODE,
+)
 
 
-def remove_links(text):
-    text = re.sub(r"\.[.\s]+", ". ", text)  # collapse consecutive dots
-    text = re.sub(r"\S+\.\S+", "", text)  # remove urls
-    text = re.sub(r"@(\S*)", "", text)  # remove handles
-    text = re.sub(r"#(\S*)", "", text)  # remove hashtags
-    return text
+def _normalize_match(match):
+    return ". " if match.lastgroup == "break" else ""
+
+
+def normalize_text(text):
+    """Prepares a post text for language detection.
+
+    Line breaks become sentence breaks, and emojis, urls, handles and hashtags are removed.
+    """
+    return _NORMALIZE_PATTERN.sub(_normalize_match, text).strip()
 
 
 def nth_item(field, index):
@@ -46,18 +45,6 @@ def nth_item(field, index):
     )
 
 
-def last_item(field):
-    return peewee.NodeList(
-        [
-            peewee.SQL('((array_agg('),
-            field,
-            peewee.SQL('))[(array_upper(array_agg('),
-            field,
-            peewee.SQL('), 1))])')
-        ]
-    )
-
-
 def log10th(field):
     return peewee.NodeList(
         [
@@ -0,0 +1,39 @@
+"""Feed server.
+
+Run with ``python -m server.web``, it serves the Flask app from ``WEB_WORKERS`` gunicorn processes
+with ``WEB_THREADS`` threads each.
+"""
+from gunicorn.app.base import BaseApplication
+
+from server import config, metrics
+
+
+class WebApplication(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Imported by every worker after forking, so none of them shares database or Redis sockets
+        from server.app import app
+
+        return app
+
+
+def main():
+    WebApplication({
+        'bind': f'0.0.0.0:{config.WEB_PORT}',
+        'workers': config.WEB_WORKERS,
+        'threads': config.WEB_THREADS,
+        'worker_class': 'gthread',
+        'accesslog': '-',
+        'child_exit': lambda _, worker: metrics.mark_process_dead(worker.pid),
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
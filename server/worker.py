@@ -0,0 +1,56 @@
+"""Background tasks.
+
+Run with ``python -m server.worker stats`` to update user statistics, or
+``python -m server.worker cleaner`` to delete old posts. ``python -m server.worker timelines``
+builds the materialized timelines once if they are empty, which the stats worker also does on start.
+"""
+import argparse
+import signal
+import threading
+
+from server import metrics, timelines
+from server.logger import logger
+from server.tasks import cleaner, statistics
+
+
+def run_stats(stop_event):
+    # Featuring top accounts relies on the timelines being built already
+    timelines.rebuild_top_spanish_if_empty()
+    statistics.StatisticsUpdater().run(stop_event)
+
+
+def run_cleaner(stop_event):
+    cleaner.run(stop_event)
+
+
+def run_timelines(stop_event):
+    timelines.rebuild_top_spanish_if_empty()
+
+
+TASKS = {
+    'stats': run_stats,
+    'cleaner': run_cleaner,
+    'timelines': run_timelines,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a background task.')
+    parser.add_argument('task', choices=TASKS.keys())
+    args = parser.parse_args()
+
+    stop_event = threading.Event()
+
+    def stop_handler(*_):
+        logger.info(f'Stopping {args.task} worker...')
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, stop_handler)
+    signal.signal(signal.SIGTERM, stop_handler)
+
+    metrics.serve()
+    TASKS[args.task](stop_event)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from server.algos import base
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 1, 1, 12, 30, 45, 123000)
+    cursor = base.page([{'uri': 'at://post', 'cid': 'bafy', 'created_at': created_at}])['cursor']
+
+    assert base.parse_cursor(cursor) == (created_at, 'bafy')
+    assert base.to_millis(base.parse_cursor(cursor)[0]) == int(cursor.split('::')[0])
+
+
+def test_to_millis_takes_naive_datetimes_as_utc():
+    aware = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+
+    assert base.to_millis(aware) == base.to_millis(aware.replace(tzinfo=None)) == int(aware.timestamp() * 1000)
+
+
+def test_parse_cursor():
+    assert base.parse_cursor(None) == (None, None)
+    with pytest.raises(ValueError):
+        base.parse_cursor('1704067200000')
@@ -0,0 +1,126 @@
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from atproto import models
+
+from server import data_filter, records
+from server.database import Interaction, Post, PostStats
+from server.data_filter import DeleteStage, Indexer
+
+
+def _post(uri):
+    return records.Post(uri, 'bafy', 'did:plc:a', 'hola', ['es'], None, None, datetime.now(timezone.utc))
+
+
+def _like(uri):
+    return records.Interaction(
+        uri, 'bafy', 'did:plc:b', 'at://did:plc:a/app.bsky.feed.post/1', 'bafy', datetime.now(timezone.utc),
+    )
+
+
+def _ops(deleted_posts=()):
+    ops = defaultdict(lambda: {'created': [], 'deleted': []})
+    ops[models.ids.AppBskyFeedPost]['deleted'].extend(deleted_posts)
+    return ops
+
+
+def test_indexer_releases_commits_once_flushed():
+    indexer = Indexer(batch_size=100, batch_interval=60)
+
+    assert indexer(_ops(), 1) == []
+    assert indexer(_ops(), 2) == []
+    assert indexer.flush() == [1, 2]
+    assert indexer.flush() == []
+
+
+def test_indexer_holds_commits_behind_pending_deletes():
+    indexer = Indexer(batch_size=100, batch_interval=60)
+    # never started, deletions stay pending until popped below
+    indexer._deletes = DeleteStage()
+
+    indexer(_ops(), 1)
+    indexer(_ops(['at://did:plc:a/app.bsky.feed.post/1']), 2)
+    indexer(_ops(), 3)
+
+    assert indexer.flush() == [1]
+
+    # as the stage does once the deletions of commit 2 are applied
+    indexer._deletes._pending.popleft()
+    assert indexer.flush() == [2, 3]
+
+
+def test_indexer_releases_replayed_commits_once():
+    indexer = Indexer(batch_size=100, batch_interval=60)
+    indexer._deletes = DeleteStage()
+
+    indexer(_ops(), 90)
+    indexer(_ops(), 91)
+    indexer(_ops(['at://did:plc:a/app.bsky.feed.post/1']), 95)
+    indexer(_ops(), 96)
+    indexer(_ops(), 97)
+    assert indexer.flush() == [90, 91]
+
+    # replayed after a reconnect
+    indexer(_ops(), 81)
+    indexer(_ops(), 82)
+    assert indexer.flush() == [81, 82]
+
+    indexer._deletes._pending.popleft()
+    assert indexer.flush() == [95, 96, 97]
+    assert indexer.flush() == []
+
+
+def test_indexer_skips_replayed_interactions():
+    uri = 'at://did:plc:b/app.bsky.feed.like/1'
+    indexer = Indexer(batch_size=100, batch_interval=60)
+
+    for seq in (1, 2):
+        ops = _ops()
+        ops[models.ids.AppBskyFeedLike]['created'].append(_like(uri))
+        indexer(ops, seq)
+        assert indexer.flush() == [seq]
+
+    assert Interaction.select().where(Interaction.uri == uri).count() == 1
+    assert PostStats.select().join(Post).where(Post.uri == 'at://did:plc:a/app.bsky.feed.post/1').get().like_count == 1
+
+
+def test_indexer_keeps_commits_of_failed_batches_pending(monkeypatch):
+    def failing_write(posts, interactions):
+        raise RuntimeError('deadlock detected')
+
+    monkeypatch.setattr(data_filter, '_write', failing_write)
+    indexer = Indexer(batch_size=100, batch_interval=60)
+    ops = _ops()
+    ops[models.ids.AppBskyFeedPost]['created'].append(_post('at://did:plc:a/app.bsky.feed.post/1'))
+
+    indexer(ops, 1)
+    indexer(_ops(), 2)
+
+    assert indexer.flush() == []
+    assert list(indexer._posts) == ['at://did:plc:a/app.bsky.feed.post/1']
+    # backing off, the batch isn't retried by new commits yet
+    assert indexer(_ops(), 3) == []
+
+
+def test_delete_stage_keeps_commits_of_failed_deletions_pending(monkeypatch):
+    attempts = []
+
+    def flaky_delete(post_uris, interaction_uris):
+        attempts.append(list(post_uris))
+        if len(attempts) == 1:
+            raise RuntimeError('deadlock detected')
+        return []
+
+    monkeypatch.setattr(data_filter, '_delete', flaky_delete)
+    stage = DeleteStage(batch_size=1, batch_interval=0)
+    stage.submit(1, ['at://did:plc:a/app.bsky.feed.post/1'], [])
+    stage.start()
+
+    deadline = time.monotonic() + 5
+    while stage.oldest_pending() is not None and time.monotonic() < deadline:
+        assert stage.oldest_pending() == 1
+        time.sleep(0.05)
+
+    assert stage.oldest_pending() is None
+    assert attempts == [['at://did:plc:a/app.bsky.feed.post/1']] * 2
@@ -0,0 +1,43 @@
+from server.data_stream import Watermark
+
+
+def test_watermark_waits_for_the_oldest_commit():
+    watermark = Watermark()
+    for seq in (1, 2, 3):
+        watermark.add(seq)
+
+    assert watermark.finish([2, 3]) is None
+    assert watermark.finish([1]) == 3
+
+
+def test_watermark_moves_over_contiguous_prefix():
+    watermark = Watermark()
+    for seq in (1, 2, 3, 4):
+        watermark.add(seq)
+
+    assert watermark.finish([1, 3]) == 1
+    assert watermark.finish([4]) == 1
+    assert watermark.finish([2]) == 4
+
+
+def test_watermark_keeps_its_value_when_nothing_finishes():
+    watermark = Watermark()
+    watermark.add(1)
+    watermark.finish([1])
+    watermark.add(2)
+
+    assert watermark.finish([]) == 1
+
+
+def test_watermark_replayed_commits_are_finished_once_per_add():
+    watermark = Watermark()
+    for seq in (1, 2):
+        watermark.add(seq)
+    # reconnected from cursor 0 before anything finished
+    for seq in (1, 2):
+        watermark.add(seq)
+
+    assert watermark.finish([1, 2]) == 2
+    assert watermark.finish([1]) == 1
+    assert watermark.finish([2]) == 2
+    assert not watermark._finished
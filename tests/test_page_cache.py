@@ -0,0 +1,46 @@
+import asyncio
+
+from redis.exceptions import ConnectionError
+
+from server import page_cache
+
+
+class _UnavailableRedis:
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            raise ConnectionError('Connection refused')
+        return command
+
+
+class _UnavailableAsyncRedis:
+    def pipeline(self, transaction=True):
+        return _UnavailableAsyncPipeline()
+
+    def __getattr__(self, name):
+        async def command(*args, **kwargs):
+            raise ConnectionError('Connection refused')
+        return command
+
+
+class _UnavailableAsyncPipeline:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+    async def execute(self):
+        raise ConnectionError('Connection refused')
+
+
+def test_get_computes_pages_without_redis(monkeypatch):
+    monkeypatch.setattr(page_cache, 'redis', _UnavailableRedis())
+
+    assert page_cache.get('at://feed', None, 30, None, lambda: {'feed': []}) == {'feed': []}
+    assert page_cache._local_locks == {}
+
+
+def test_get_async_computes_pages_without_redis(monkeypatch):
+    monkeypatch.setattr(page_cache, 'async_redis', _UnavailableAsyncRedis())
+
+    async def compute():
+        return {'feed': []}
+
+    assert asyncio.run(page_cache.get_async('at://feed', None, 30, None, compute)) == {'feed': []}
@@ -0,0 +1,40 @@
+from atproto import models
+
+from server import records
+
+_URI = 'at://did:plc:a/app.bsky.feed.post/1'
+
+
+def _post(**fields):
+    return {'$type': models.ids.AppBskyFeedPost, 'text': 'hola', 'createdAt': '2024-01-01T00:00:00Z', **fields}
+
+
+def test_post_from_raw():
+    reply = {'parent': {'uri': 'at://parent', 'cid': 'p'}, 'root': {'uri': 'at://root', 'cid': 'r'}}
+    post = records.from_raw(models.ids.AppBskyFeedPost, _URI, 'bafy', 'did:plc:a', _post(langs=['es'], reply=reply))
+
+    assert (post.text, post.langs, post.reply_parent, post.reply_root) == ('hola', ['es'], 'at://parent', 'at://root')
+    assert post.created_at.year == 2024
+
+
+def test_from_raw_checks_the_collection():
+    assert records.from_raw(models.ids.AppBskyFeedLike, _URI, 'bafy', 'did:plc:a', _post()) is None
+
+
+def test_from_raw_skips_values_the_database_rejects():
+    for raw in (
+        _post(text=3),
+        _post(langs='es'),
+        _post(langs=[None]),
+        _post(createdAt='yesterday'),
+        _post(createdAt='99999-01-01'),
+        _post(reply={'parent': {'uri': 'at://' + 'a' * 300}, 'root': {'uri': 'at://root'}}),
+        _post(reply={'parent': {'uri': 'at://\x00'}, 'root': {'uri': 'at://root'}}),
+    ):
+        assert records.from_raw(models.ids.AppBskyFeedPost, _URI, 'bafy', 'did:plc:a', raw) is None
+
+
+def test_interaction_from_raw_requires_a_subject():
+    raw = {'$type': models.ids.AppBskyFeedLike, 'subject': {'uri': _URI}, 'createdAt': '2024-01-01T00:00:00Z'}
+
+    assert records.from_raw(models.ids.AppBskyFeedLike, 'at://like', 'bafy', 'did:plc:b', raw) is None
@@ -0,0 +1,12 @@
+from server.utils import normalize_text
+
+
+def test_normalize_text_collapses_line_breaks():
+    assert normalize_text('a\nb') == 'a. b'
+    assert normalize_text('a\n\nb') == 'a. b'
+    assert normalize_text('a.\n\n\nb') == 'a. b'
+    assert normalize_text('a\n \n.b') == 'a. b'
+
+
+def test_normalize_text_removes_links_handles_and_hashtags():
+    assert normalize_text('hola @alice.bsky.social mira https://example.com/a #cosas') == 'hola  mira'